@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+# groupwise-ics: synchronize GroupWise calendar to ICS file and back
+# Copyright (C) 2013  Cedric Bosdonnat <cedric@bosdonnat.fr>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Compares the extraction of the text/calendar part of invitation mails
+# using mime.find_calendar_part and the email module.
+
+import base64
+import email
+import optparse
+import quopri
+import sys
+import time
+from mime import find_calendar_part
+
+ICAL = '\r\n'.join(['BEGIN:VCALENDAR',
+                    'PRODID:-//Novell Inc//Groupwise 8.0.2',
+                    'VERSION:2.0',
+                    'METHOD:REQUEST',
+                    'BEGIN:VEVENT',
+                    'UID:20131007T194020Z-3587-100-1732-0@laptop',
+                    'X-GWRECORDID:52541DD3.A8D:230:1E5F',
+                    'DTSTAMP:20131007T194119Z',
+                    'DTSTART:20131008T130000Z',
+                    'DTEND:20131008T133000Z',
+                    'SUMMARY:Weekly team meeting =C3=A9',
+                    'ORGANIZER;CN=Joe Hacker:MAILTO:joe@hacker.com'] +
+                   ['ATTENDEE;CN=Attendee %d;PARTSTAT=NEEDS-ACTION:MAILTO:a%d@hacker.com' % (i, i)
+                    for i in range(20)] +
+                   ['END:VEVENT',
+                    'END:VCALENDAR',
+                    ''])
+
+TEXT = 'You have been invited to the weekly team meeting.\r\n' * 20
+HTML = '<html><body>%s</body></html>\r\n' % ('<p>You have been invited to the meeting.</p>\r\n' * 200)
+ATTACHMENT = base64.encodestring('%PDF-1.4 ' + 'x' * 100000).replace('\n', '\r\n')
+
+def headers(content_type, encoding = None):
+    lines = ['Content-Type: %s' % content_type]
+    if encoding is not None:
+        lines.append('Content-Transfer-Encoding: %s' % encoding)
+    return '\r\n'.join(lines)
+
+def multipart(subtype, boundary, parts):
+    lines = [headers('multipart/%s;\r\n\tboundary="%s"' % (subtype, boundary)), '',
+             'This is a multi-part message in MIME format.']
+    for part in parts:
+        lines.append('--%s' % boundary)
+        lines.append(part)
+    lines.append('--%s--' % boundary)
+    lines.append('')
+    return '\r\n'.join(lines)
+
+def leaf(content_type, body, encoding = None):
+    return '%s\r\n\r\n%s' % (headers(content_type, encoding), body)
+
+def mail(body):
+    return '\r\n'.join(['Received: from gw.hacker.com (gw.hacker.com [10.0.0.1])',
+                        '\tby mx.hacker.com with ESMTP id 42',
+                        'From: Joe Hacker <joe@hacker.com>',
+                        'To: Alice <alice@hacker.com>',
+                        'Subject: Weekly team meeting',
+                        'Date: Mon, 07 Oct 2013 21:41:19 +0200',
+                        'Message-ID: <52541DD3.A8D@hacker.com>',
+                        'MIME-Version: 1.0',
+                        body])
+
+def corpus():
+    calendar = 'text/calendar; method=REQUEST; charset=utf-8'
+    return {
+        # GroupWise: text and html alternatives, then the calendar
+        'groupwise': mail(multipart('mixed', '__GW_MIXED', [
+                        multipart('alternative', '__GW_ALT', [
+                            leaf('text/plain; charset=utf-8', TEXT, '8bit'),
+                            leaf('text/html; charset=utf-8', HTML, '8bit')]),
+                        leaf(calendar, ICAL, '8bit')])),
+        # Exchange: base64 calendar after quoted-printable alternatives
+        'exchange': mail(multipart('alternative', '_000_EXCH', [
+                        leaf('text/plain; charset="utf-8"', quopri.encodestring(TEXT), 'quoted-printable'),
+                        leaf('text/html; charset="utf-8"', quopri.encodestring(HTML), 'quoted-printable'),
+                        leaf(calendar, base64.encodestring(ICAL).replace('\n', '\r\n'), 'base64')])),
+        # Google: calendar alternative followed by an invite.ics attachment
+        'google': mail(multipart('mixed', '0016e6d', [
+                        multipart('alternative', '0016e6c', [
+                            leaf('text/plain; charset=UTF-8', TEXT, '7bit'),
+                            leaf('text/html; charset=UTF-8', HTML, 'quoted-printable'),
+                            leaf(calendar, ICAL, '7bit')]),
+                        leaf('application/ics; name="invite.ics"',
+                             base64.encodestring(ICAL).replace('\n', '\r\n'), 'base64')])),
+        # Lightning: quoted-printable calendar and a large attachment
+        'lightning': mail(multipart('mixed', '------------0308', [
+                        leaf('text/plain; charset=UTF-8', TEXT, '7bit'),
+                        leaf(calendar, quopri.encodestring(ICAL), 'quoted-printable'),
+                        leaf('application/pdf; name="agenda.pdf"', ATTACHMENT, 'base64')])),
+        # Evolution: single text/calendar body
+        'evolution': mail(leaf(calendar, ICAL, '8bit')),
+        # Invitation forwarded as an attachment
+        'forward': mail(multipart('mixed', '__FWD_MIXED', [
+                        leaf('text/plain; charset=utf-8', TEXT, '8bit'),
+                        leaf('message/rfc822', mail(multipart('alternative', '__GW_ALT', [
+                            leaf('text/plain; charset=utf-8', TEXT, '8bit'),
+                            leaf(calendar, ICAL, '8bit')])))])),
+    }
+
+def extract_with_email(raw):
+    def walk(mail):
+        if mail.is_multipart():
+            for part in mail.get_payload():
+                payload = walk(part)
+                if payload is not None:
+                    return payload
+        elif mail.get_content_type().startswith('text/calendar'):
+            return mail.get_payload(decode = True)
+        return None
+    return walk(email.message_from_string(raw))
+
+def measure(func, raw, iterations):
+    start = time.time()
+    for i in xrange(iterations):
+        func(raw)
+    return (time.time() - start) / iterations
+
+def main(args):
+    parser = optparse.OptionParser(usage = 'usage: %prog [options]')
+    parser.add_option('--iterations', dest = 'iterations',
+                      type = 'int', default = 500,
+                      help = 'Number of extractions per mail. (default: 500)')
+    (options, args) = parser.parse_args()
+
+    print '%-10s %8s %12s %12s %8s' % ('shape', 'size', 'email (us)', 'scanner (us)', 'speedup')
+    for (name, raw) in sorted(corpus().items()):
+        if find_calendar_part(raw) != extract_with_email(raw):
+            print '%s: the extracted payloads differ' % name
+            return 1
+        reference = measure(extract_with_email, raw, options.iterations)
+        scanned = measure(find_calendar_part, raw, options.iterations)
+        print '%-10s %8d %12.1f %12.1f %7.1fx' % (name, len(raw), reference * 1e6,
+                                                  scanned * 1e6, reference / scanned)
+    return 0
+
+if __name__ == '__main__':
+    ret = main(sys.argv)
+    sys.exit(ret)
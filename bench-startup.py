@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+# groupwise-ics: synchronize GroupWise calendar to ICS file and back
+# Copyright (C) 2013  Cedric Bosdonnat <cedric@bosdonnat.fr>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Measures the time needed by the scripts to start, compared to the one of
+# the bare interpreter, and checks that loading them doesn't import the
+# modules only needed to talk to GroupWise or watch files.
+
+import optparse
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from gwconfig import load_config
+
+SCRIPTS = ['groupwise-to-ics', 'ics-to-groupwise']
+HEAVY_MODULES = ['imaplib', 'email', 'httplib', 'xml.etree', 'pyinotify']
+
+# Loads a script without running its main() and prints the heavy modules
+LOADED_MODULES = '''
+import imp, sys
+imp.load_source('script', sys.argv[1])
+print ' '.join([name for name in sys.argv[2:] if name in sys.modules])
+'''
+
+INI_CONFIG = '''# Keep this file only readable by you
+
+[gw]
+imap = your.imap.groupwise.host
+login = your.username
+password = your_pass
+'''
+
+PYTHON_CONFIG = '''# Keep this file only readable by you
+
+gw = {
+    'imap'      : 'your.imap.groupwise.host',
+    'login'     : 'your.username',
+    'password'  : 'your_pass'
+}
+'''
+
+def get_script(name):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+
+def measure_command(command, runs):
+    '''
+    @result: the median wall time of the command in seconds
+    '''
+    devnull = open(os.devnull, 'w')
+    times = []
+    for i in xrange(runs):
+        start = time.time()
+        subprocess.call(command, stdout = devnull, stderr = devnull)
+        times.append(time.time() - start)
+    devnull.close()
+    times.sort()
+    return times[len(times) / 2]
+
+def get_heavy_modules(script):
+    output = subprocess.check_output([sys.executable, '-c', LOADED_MODULES,
+                                      get_script(script)] + HEAVY_MODULES,
+                                     cwd = os.path.dirname(get_script(script)))
+    return output.split()
+
+def measure_config(content, iterations):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'config')
+        fp = open(path, 'w')
+        fp.write(content)
+        fp.close()
+        start = time.time()
+        for i in xrange(iterations):
+            load_config(path)
+        return (time.time() - start) / iterations
+    finally:
+        shutil.rmtree(tmpdir)
+
+def main(args):
+    parser = optparse.OptionParser(usage = 'usage: %prog [options]')
+    parser.add_option('--runs', dest = 'runs',
+                      type = 'int', default = 20,
+                      help = 'Number of times each script is started. (default: 20)')
+    parser.add_option('--budget-ms', dest = 'budget',
+                      type = 'float', default = 50,
+                      metavar = 'MS',
+                      help = 'Maximum time spent by a script on top of the '
+                             'interpreter startup. (default: 50)')
+    (options, args) = parser.parse_args()
+
+    result = 0
+    baseline = measure_command([sys.executable, '-c', 'pass'], options.runs)
+    print '%-20s %10s %10s  %s' % ('script', 'total (ms)', 'own (ms)', 'heavy modules')
+    print '%-20s %10.1f %10s' % ('python', baseline * 1e3, '-')
+    for script in SCRIPTS:
+        total = measure_command([sys.executable, get_script(script), '--help'], options.runs)
+        own = (total - baseline) * 1e3
+        heavy = get_heavy_modules(script)
+        print '%-20s %10.1f %10.1f  %s' % (script, total * 1e3, own,
+                                           ', '.join(heavy) or 'none')
+        if own > options.budget:
+            print '%s: %.1f ms over the %.1f ms budget' % (script, own - options.budget,
+                                                           options.budget)
+            result = 1
+        if len(heavy) > 0:
+            print '%s: imports %s on startup' % (script, ', '.join(heavy))
+            result = 1
+
+    print
+    print '%-20s %10s' % ('config', 'load (us)')
+    print '%-20s %10.1f' % ('ini', measure_config(INI_CONFIG, 1000) * 1e6)
+    print '%-20s %10.1f' % ('python', measure_config(PYTHON_CONFIG, 1000) * 1e6)
+    return result
+
+if __name__ == '__main__':
+    ret = main(sys.argv)
+    sys.exit(ret)
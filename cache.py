@@ -0,0 +1,249 @@
+# groupwise-ics: synchronize GroupWise calendar to ICS file and back
+# Copyright (C) 2013  Cedric Bosdonnat <cedric@bosdonnat.fr>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import hashlib
+import json
+import os
+import os.path
+import re
+import sys
+import zlib
+from cal import Event
+
+# Largest decompressed event entry: avoids loading zlib bombs
+MAX_ENTRY_SIZE = 4 * 1024 * 1024
+
+def is_string(value):
+    return isinstance(value, str)
+
+def is_params(value):
+    return isinstance(value, dict) and \
+           all([is_string(key) and is_string(value[key]) for key in value])
+
+def is_parametrized(value):
+    return isinstance(value, tuple) and len(value) == 2 and \
+           is_params(value[0]) and (value[1] is None or is_string(value[1]))
+
+def to_str(value):
+    '''
+    Converts back the unicode strings of decoded JSON to byte strings and
+    the lists to tuples. The strings are encoded as latin-1 so that any
+    byte survives the round trip.
+    '''
+    if isinstance(value, unicode):
+        return value.encode('latin-1')
+    if isinstance(value, list):
+        return tuple([to_str(item) for item in value])
+    if isinstance(value, dict):
+        return dict([(to_str(key), to_str(value[key])) for key in value])
+    return value
+
+def dump_state(state):
+    return json.dumps(state, encoding = 'latin-1')
+
+def load_state(data):
+    '''
+    Reads an Event.get_state() tuple written by dump_state, checking its
+    structure: the entries may have been written by other users.
+
+    @raise ValueError: if the data isn't a valid state
+    '''
+    state = to_str(json.loads(data, encoding = 'latin-1'))
+    if state is None:
+        return None
+    if not isinstance(state, tuple) or len(state) != 3:
+        raise ValueError('Invalid event state')
+    (lines, properties, attendees) = state
+    if not isinstance(lines, tuple) or not all([is_string(line) for line in lines]):
+        raise ValueError('Invalid event lines')
+    if not isinstance(properties, tuple) or not isinstance(attendees, tuple):
+        raise ValueError('Invalid event properties')
+    for item in properties:
+        if not isinstance(item, tuple) or len(item) != 3 or not is_string(item[0]) or \
+                not (is_string(item[1]) or is_parametrized(item[1])) or \
+                not (item[2] is None or isinstance(item[2], int)):
+            raise ValueError('Invalid event property')
+    for attendee in attendees:
+        if not is_parametrized(attendee):
+            raise ValueError('Invalid event attendee')
+    return (list(lines), properties, list(attendees))
+
+class EventCache(object):
+    '''
+    On-disk cache of the events parsed from invitation mails, which can be
+    shared between runs, and between the members of a group if shared is
+    True. Anyone able to write to the cache can change the events of the
+    others: only share it between trusted accounts. The entries are checked
+    when reading them though, so that broken ones can't do more harm.
+
+    Two kinds of entries are stored, named after the SHA-1 of their key:
+      - events: the JSON state of the event parsed from a text/calendar
+        payload, so that identical invitations are only parsed once.
+      - mails: the hash of the payload found in a raw mail, so that mails
+        already seen don't even need their MIME structure to be walked.
+
+    The least recently used entries are removed when the cache grows over
+    max_size bytes. The size is only tracked approximately when several
+    processes share the cache.
+    '''
+    VERSION = 'v2-py%d.%d' % sys.version_info[:2]
+
+    def __init__(self, path, max_size = 64 * 1024 * 1024, shared = False):
+        '''
+        @param shared: if True, the cache directories and entries are
+                       readable and writable by their group
+        '''
+        self.path = os.path.join(path, EventCache.VERSION)
+        self.max_size = max_size
+        self.size = None
+        self.dir_mode = 0700
+        self.file_mode = 0600
+        if shared:
+            self.dir_mode = 0770
+            self.file_mode = 0660
+
+    def get_entry_path(self, kind, key):
+        return os.path.join(self.path, kind, key[:2], key)
+
+    def read(self, kind, key):
+        path = self.get_entry_path(kind, key)
+        try:
+            fp = open(path, 'rb')
+            data = fp.read()
+            fp.close()
+        except IOError:
+            return None
+        # Mark the entry as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return data
+
+    def make_dirs(self, path):
+        '''
+        Like os.makedirs, but with the mode of the cache whatever the umask
+        '''
+        if os.path.isdir(path):
+            return
+        self.make_dirs(os.path.dirname(path))
+        try:
+            os.mkdir(path)
+            os.chmod(path, self.dir_mode)
+        except OSError:
+            # Another process may have created it meanwhile
+            pass
+
+    def write(self, kind, key, data):
+        path = self.get_entry_path(kind, key)
+        self.make_dirs(os.path.dirname(path))
+
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, self.file_mode)
+        os.fchmod(fd, self.file_mode)
+        fp = os.fdopen(fd, 'wb')
+        fp.write(data)
+        fp.close()
+        os.rename(tmp_path, path)
+
+        if self.size is None:
+            self.size = self.compute_size()
+        else:
+            self.size += len(data)
+        if self.size > self.max_size:
+            self.evict()
+
+    def list_entries(self):
+        entries = []
+        for (dirpath, dirnames, filenames) in os.walk(self.path):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def compute_size(self):
+        return sum([size for (mtime, size, path) in self.list_entries()])
+
+    def evict(self):
+        '''
+        Removes the least recently used entries until the cache is back
+        under 80% of its maximum size, to avoid evicting on each write.
+        '''
+        entries = self.list_entries()
+        entries.sort()
+        self.size = sum([size for (mtime, size, path) in entries])
+        for (mtime, size, path) in entries:
+            if self.size <= self.max_size * 0.8:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.size -= size
+
+    @staticmethod
+    def hash(data):
+        return hashlib.sha1(data).hexdigest()
+
+    def get_event(self, mail, extract, parse):
+        '''
+        @param mail: the raw mail
+        @param extract: function returning the text/calendar payload of a mail
+        @param parse: function returning the event parsed from a payload,
+                      or None if there is no event in it
+        @result: the event of the mail or None
+        '''
+        payload = None
+        extracted = False
+        mail_key = EventCache.hash(mail)
+        payload_key = self.read('mails', mail_key)
+        if payload_key is not None and re.match('^[0-9a-f]{40}$', payload_key) is None:
+            # Broken entry, and a possible path outside of the cache
+            payload_key = None
+        if payload_key is None:
+            payload = extract(mail)
+            extracted = True
+            payload_key = EventCache.hash(payload or '')
+            self.write('mails', mail_key, payload_key)
+
+        data = self.read('events', payload_key)
+        if data is not None:
+            try:
+                decompressor = zlib.decompressobj()
+                data = decompressor.decompress(data, MAX_ENTRY_SIZE)
+                if decompressor.unconsumed_tail != '':
+                    raise ValueError('Event entry too large')
+                state = load_state(data)
+                if state is None:
+                    return None
+                return Event.from_state(state)
+            except (zlib.error, ValueError):
+                # Corrupted entry: parse the payload again to replace it
+                pass
+
+        if not extracted:
+            payload = extract(mail)
+        event = None
+        if payload is not None:
+            event = parse(payload)
+        state = None
+        if event is not None:
+            state = event.get_state()
+        self.write('events', payload_key, zlib.compress(dump_state(state)))
+        return event
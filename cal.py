@@ -16,6 +16,51 @@
 import os.path
 import datetime
 import time
+import bisect
+
+def parse_utc_datetime(value):
+    '''
+    Converts a DATE or DATE-TIME iCalendar value into a naive datetime.
+    Values are expected to be UTC already, as returned by Event.datetime_to_utc.
+
+    @result: the datetime or None if the value couldn't be parsed
+    '''
+    for fmt in ('%Y%m%dT%H%M%SZ', '%Y%m%dT%H%M%S', '%Y%m%d'):
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    return None
+
+def parse_date(value):
+    '''
+    Parses a window bound: either an UTC date like 20131008 or 20131008T130000Z,
+    'now', 'today' or a number of days relative to today like +90d or -7d.
+    Relative values give a different result every day.
+
+    @result: the naive UTC datetime or None if the value is invalid
+    '''
+    today = datetime.datetime.utcnow().replace(hour = 0, minute = 0,
+                                                second = 0, microsecond = 0)
+    if value == 'now':
+        return datetime.datetime.utcnow()
+    if value == 'today':
+        return today
+    if value[:1] in ('+', '-') and value.endswith('d'):
+        try:
+            return today + datetime.timedelta(days = int(value[:-1]))
+        except ValueError:
+            return None
+    return parse_utc_datetime(value)
+
+def normalize_address(address):
+    '''
+    Lower cases an organizer or attendee address and strips the MAILTO: prefix
+    '''
+    address = address.strip().lower()
+    if address.startswith('mailto:'):
+        address = address[len('mailto:'):]
+    return address
 
 class LineUnwrapper(object):
     def __init__(self, s):
@@ -42,14 +87,33 @@ class LineUnwrapper(object):
                 self.saved = line.strip()
 
 class Calendar(object):
-    def __init__(self, ical):
+    def __init__(self, ical, since = None, until = None, lazy = False):
+        '''
+        @param since: if not None, skip the events ending before that
+                      naive UTC datetime
+        @param until: if not None, skip the events starting after that
+                      naive UTC datetime
+        @param lazy: if True, the events will be LazyEvent objects
+
+        The window is only meant for loading a complete calendar. The exports
+        don't use it when parsing invitations: an invitation skipped there
+        couldn't replace an older version of its event, so they apply the
+        window when writing instead.
+        '''
         self.events = []
+        self.indexes = None
+        self.since = since
+        self.until = until
+        self.event_class = Event
+        if lazy:
+            self.event_class = LazyEvent
         self.parse(ical)
 
     def parse(self, ical):
         content = LineUnwrapper(ical)
         vtimezone = None
         vevent = None
+        skip_vevent = False
         tzmap = {}
 
         for (real_lines, line) in content.each_line():
@@ -63,12 +127,32 @@ class Calendar(object):
                 vtimezone = Timezone()
             elif vevent is not None:
                 if line == 'END:VEVENT':
-                    self.events.append(vevent)
+                    if not skip_vevent and vevent.overlaps(self.since, self.until):
+                        self.events.append(vevent)
                     vevent = None
-                else:
+                    skip_vevent = False
+                elif not skip_vevent:
                     vevent.parseline(real_lines, line)
+                    # No need to parse the rest of an event starting after the window
+                    if self.until is not None and line.startswith('DTSTART'):
+                        interval = vevent.get_interval()
+                        skip_vevent = interval is not None and interval[0] >= self.until
             elif vtimezone is None and line == 'BEGIN:VEVENT':
-                vevent = Event(tzmap)
+                vevent = self.event_class(tzmap)
+
+        self.reset_indexes()
+
+    def reset_indexes(self):
+        '''
+        Drops the cached query indexes. This needs to be called whenever
+        the events list or the events themselves are changed.
+        '''
+        self.indexes = None
+
+    def get_indexes(self):
+        if self.indexes is None:
+            self.indexes = CalendarIndexes(self.events)
+        return self.indexes
 
     def diff(self, calendar):
         '''
@@ -107,13 +191,101 @@ class Calendar(object):
         return (changed, removed, added, unchanged)
 
     def get_events_by_uid(self):
-        by_uid = {}
+        '''
+        @result: dictionary of the events using the GroupWise record ID or
+                 the UID as key. The dictionary is cached: don't modify it.
+        '''
+        return self.get_indexes().by_uid
+
+    def get_events_between(self, since, until):
+        '''
+        Searches for the events overlapping the [since, until) time window.
+
+        @param since: naive UTC datetime or None for no lower bound
+        @param until: naive UTC datetime or None for no upper bound
+        @result: list of the events sorted by start time. Events without
+                 DTSTART are never returned.
+        '''
+        return self.get_indexes().between(since, until)
+
+    def get_events_involving(self, address):
+        '''
+        Searches for the events having address as organizer or attendee.
+        The comparison isn't case sensitive and the MAILTO: prefix is optional.
+        '''
+        return list(self.get_indexes().by_address.get(normalize_address(address), []))
+
+class CalendarIndexes(object):
+    '''
+    Lookup structures computed for a list of events. Each one is only built
+    on first use: the address and time indexes decode properties which the
+    uid lookups don't need, and would materialize LazyEvent objects.
+    '''
+    def __init__(self, events):
+        self.events = events
+        self.uids = None
+        self.addresses = None
+        self.intervals = None
+        self.starts = None
+        self.max_duration = None
+
+    def get_by_uid(self):
+        if self.uids is None:
+            self.uids = {}
+            for event in self.events:
+                uid = event.uid
+                if event.gwrecordid is not None:
+                    uid = event.gwrecordid
+                self.uids[uid] = event
+        return self.uids
+    by_uid = property(get_by_uid)
+
+    def get_by_address(self):
+        if self.addresses is None:
+            self.addresses = {}
+            for event in self.events:
+                addresses = set()
+                if event.organizer is not None and event.organizer.value is not None:
+                    addresses.add(normalize_address(event.organizer.value))
+                for attendee in event.attendees:
+                    if attendee.value is not None:
+                        addresses.add(normalize_address(attendee.value))
+                for address in addresses:
+                    self.addresses.setdefault(address, []).append(event)
+        return self.addresses
+    by_address = property(get_by_address)
+
+    def build_intervals(self):
+        self.intervals = []
+        self.max_duration = datetime.timedelta(0)
         for event in self.events:
-            uid = event.uid
-            if event.gwrecordid is not None:
-                uid = event.gwrecordid
-            by_uid[uid] = event
-        return by_uid
+            interval = event.get_interval()
+            if interval is not None:
+                self.intervals.append((interval[0], interval[1], event))
+                self.max_duration = max(self.max_duration, interval[1] - interval[0])
+
+        self.intervals.sort(key = lambda interval: interval[0])
+        self.starts = [interval[0] for interval in self.intervals]
+
+    def between(self, since, until):
+        if self.intervals is None:
+            self.build_intervals()
+
+        # Only the events starting after since - max_duration can overlap
+        # the window: no need to look at the older ones
+        first = 0
+        if since is not None:
+            first = bisect.bisect_left(self.starts, since - self.max_duration)
+        last = len(self.starts)
+        if until is not None:
+            last = bisect.bisect_left(self.starts, until)
+
+        result = []
+        for (start, end, event) in self.intervals[first:last]:
+            # Zero-length events are kept if they start in the window
+            if since is None or end > since or start >= since:
+                result.append(event)
+        return result
 
 
 class Timezone(datetime.tzinfo):
@@ -248,6 +420,19 @@ class ParametrizedValue(object):
         return result
 
 class Event(object):
+    # Prefixes of the lines parsed as properties, the first match wins
+    PROPERTIES = [('DTSTART', 'dtstart'),
+                  ('DTEND', 'dtend'),
+                  ('UID:', 'uid'),
+                  ('X-GWRECORDID:', 'gwrecordid'),
+                  ('DTSTAMP:', 'dtstamp'),
+                  ('SUMMARY:', 'summary'),
+                  ('LOCATION:', 'location'),
+                  ('DESCRIPTION:', 'description'),
+                  ('STATUS:', 'status'),
+                  ('ORGANIZER', 'organizer'),
+                  ('ATTENDEE', 'attendees')]
+
     def __init__(self, tzmap):
         self.lines = []
         self.properties = {}
@@ -335,39 +520,87 @@ class Event(object):
         self.set_property(value, 'organizer', 'ORGANIZER%s')
     organizer = property(get_organizer, set_organizer)
 
-    def parseline(self, real_lines, line):
-        if line.startswith('DTSTART'):
-            value = line[len('DTSTART'):]
-            self.dtstart = self.datetime_to_utc(value)
-        elif line.startswith('DTEND'):
-            value = line[len('DTEND'):]
-            self.dtend = self.datetime_to_utc(value)
-        elif line.startswith('UID:'):
-            self.uid = line[len('UID:'):]
-        elif line.startswith('X-GWRECORDID:'):
-            self.gwrecordid = line[len('X-GWRECORDID:'):]
-        elif line.startswith('DTSTAMP:'):
-            utc = self.datetime_to_utc(line[len('DTSTAMP'):])
+    def find_property(self, line):
+        '''
+        @result: (key, offset) tuple where key is the name of the property
+                 parsed from the line and offset the position of its value
+                 in the line, or (None, 0) if the line isn't parsed.
+        '''
+        for (prefix, key) in Event.PROPERTIES:
+            if line.startswith(prefix):
+                return (key, len(prefix))
+        return (None, 0)
+
+    def decode_property(self, key, value):
+        if key == 'dtstart' or key == 'dtend':
+            return self.datetime_to_utc(value)
+        elif key == 'dtstamp':
+            utc = self.datetime_to_utc(':%s' % value)
             if utc.startswith(':'):
                 utc = utc[1:]
-            self.dtstamp = utc
-        elif line.startswith('SUMMARY:'):
-            self.summary = line[len('SUMMARY:'):]
-        elif line.startswith('LOCATION:'):
-            self.location = line[len('LOCATION:'):]
-        elif line.startswith('DESCRIPTION:'):
-            self.description = line[len('DESCRIPTION:'):]
-        elif line.startswith('STATUS:'):
-            self.status = line[len('STATUS:'):]
-        elif line.startswith('ORGANIZER'):
-            self.organizer = ParametrizedValue(line[len('ORGANIZER'):])
-        elif line.startswith('ATTENDEE'):
-            self.attendees.append(ParametrizedValue(line[len('ATTENDEE'):]))
+            return utc
+        elif key == 'organizer' or key == 'attendees':
+            return ParametrizedValue(value)
+        return value
+
+    def parseline(self, real_lines, line):
+        (key, offset) = self.find_property(line)
+        if key == 'attendees':
+            self.attendees.append(self.decode_property(key, line[offset:]))
+        elif key is not None:
+            setattr(self, key, self.decode_property(key, line[offset:]))
         else:
             # Don't add lines if we got a property: the line is
             # auto-added in the property setter
             self.lines.extend(real_lines)
 
+    def get_interval(self):
+        '''
+        @result: (start, end) tuple of naive UTC datetimes or None if the event
+                 has no usable DTSTART. Events without DTEND last one day if
+                 they are all-day events, no time otherwise.
+        '''
+        if self.dtstart is None:
+            return None
+        start_value = ParametrizedValue(self.dtstart).value
+        start = parse_utc_datetime(start_value or '')
+        if start is None:
+            return None
+
+        end = None
+        if self.dtend is not None:
+            end = parse_utc_datetime(ParametrizedValue(self.dtend).value or '')
+        if end is None:
+            end = start
+            if len(start_value) == len('YYYYMMDD'):
+                end = start + datetime.timedelta(days = 1)
+        return (start, max(start, end))
+
+    def is_recurring(self):
+        for line in self.lines:
+            if line.startswith('RRULE') or line.startswith('RDATE'):
+                return True
+        return False
+
+    def overlaps(self, since, until):
+        '''
+        Tells whether the event happens in the [since, until) window, both
+        bounds being naive UTC datetimes or None. Events without dates are
+        always kept, and so are recurring events ending before since as
+        their occurrences aren't expanded.
+        '''
+        if since is None and until is None:
+            return True
+        interval = self.get_interval()
+        if interval is None:
+            return True
+        (start, end) = interval
+        if until is not None and start >= until:
+            return False
+        if since is not None and end <= since and start < since:
+            return self.is_recurring()
+        return True
+
     def datetime_to_utc(self,local):
         value = ParametrizedValue(local)
         if 'TZID' in value.params:
@@ -392,6 +625,38 @@ class Event(object):
 
         return value.to_ical()
 
+    def get_state(self):
+        '''
+        @result: the event as tuples, lists and dictionaries of strings, which
+                 can be serialized with marshal and loaded with from_state()
+        '''
+        properties = []
+        for key in self.properties:
+            (value, lineno) = self.properties[key]
+            if isinstance(value, ParametrizedValue):
+                value = (value.params, value.value)
+            properties.append((key, value, lineno))
+        attendees = [(attendee.params, attendee.value) for attendee in self.attendees]
+        return (list(self.lines), properties, attendees)
+
+    @staticmethod
+    def from_state(state):
+        def parametrized_value(params, value):
+            parametrized = ParametrizedValue('')
+            parametrized.params = params
+            parametrized.value = value
+            return parametrized
+
+        (lines, properties, attendees) = state
+        event = Event({})
+        event.lines = list(lines)
+        for (key, value, lineno) in properties:
+            if isinstance(value, tuple):
+                value = parametrized_value(*value)
+            event.properties[key] = (value, lineno)
+        event.attendees = [parametrized_value(*attendee) for attendee in attendees]
+        return event
+
     def to_ical(self):
         attendees_lines = []
         for attendee in self.attendees:
@@ -412,3 +677,99 @@ class Event(object):
         props_equal = set(self_props.items()) ^ set(other_props.items())
         attendees_equal = set(self.attendees) ^ set(other.attendees)
         return len(props_equal) == 0 and len(attendees_equal) == 0
+
+class LazyEvent(Event):
+    '''
+    Event decoding its properties only when they are first accessed.
+
+    Until then, the unfolded lines of the properties are kept in the pending
+    dictionary with the offset of their value, and a None placeholder holds
+    their position in the lines. The attendees are kept in the same way.
+    '''
+    def __init__(self, tzmap):
+        self.pending = {}
+        self.pending_attendees = []
+        Event.__init__(self, tzmap)
+
+    def decode_pending(self, key):
+        (lineno, line, offset) = self.pending.pop(key)
+        # The property setter will write the line at the reserved position
+        self._properties[key] = (None, lineno)
+        setattr(self, key, self.decode_property(key, line[offset:]))
+
+    def materialize(self):
+        for key in list(self.pending.keys()):
+            self.decode_pending(key)
+        if len(self.pending_attendees) > 0:
+            for (line, offset) in self.pending_attendees:
+                self._attendees.append(self.decode_property('attendees', line[offset:]))
+            self.pending_attendees = []
+
+    def get_lines(self):
+        self.materialize()
+        return self._lines
+    def set_lines(self, value):
+        self.materialize()
+        self._lines = value
+    lines = property(get_lines, set_lines)
+
+    def get_properties(self):
+        self.materialize()
+        return self._properties
+    def set_properties(self, value):
+        self.materialize()
+        self._properties = value
+    properties = property(get_properties, set_properties)
+
+    def get_attendees(self):
+        self.materialize()
+        return self._attendees
+    def set_attendees(self, value):
+        self.pending_attendees = []
+        self._attendees = value
+    attendees = property(get_attendees, set_attendees)
+
+    def get_property(self, key):
+        if key in self.pending:
+            self.decode_pending(key)
+        value = None
+        if key in self._properties:
+            value = self._properties[key][0]
+        return value
+    def set_property(self, value, key, pattern):
+        if key in self.pending:
+            # Drop the pending value, but keep its position
+            self._properties[key] = (None, self.pending.pop(key)[0])
+
+        if key not in self._properties:
+            lineno = len(self._lines)
+            self._lines.append(pattern % value)
+            self._properties[key] = (value, lineno)
+        else:
+            lineno = self._properties[key][1]
+            self._properties[key] = (value, lineno)
+            self._lines[lineno] = pattern % value
+
+    def parseline(self, real_lines, line):
+        (key, offset) = self.find_property(line)
+        if key == 'attendees':
+            self.pending_attendees.append((line, offset))
+        elif key is not None:
+            # Keep the position of the first line for that property
+            if key in self.pending:
+                lineno = self.pending[key][0]
+            elif key in self._properties:
+                lineno = self._properties.pop(key)[1]
+            else:
+                lineno = len(self._lines)
+                self._lines.append(None)
+            self.pending[key] = (lineno, line, offset)
+        else:
+            self._lines.extend(real_lines)
+
+    def is_recurring(self):
+        for line in self._lines:
+            if line is not None and \
+                    (line.startswith('RRULE') or line.startswith('RDATE')):
+                return True
+        return False
@@ -16,60 +16,194 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import imaplib
-import email
+# imaplib, email, httplib and xml.etree take a noticeable part of the
+# startup time: they are imported by the methods needing them.
 import sys
+import threading
 from cal import Calendar, Event
+from mime import find_calendar_part, MimeError
 from datetime import datetime
 import os
 import os.path
-import httplib
-import xml.etree.ElementTree as ET
+import select
+import time
 
 class GWConnection:
-    def __init__(self, server):
-        self.imap = imaplib.IMAP4_SSL(server)
+    def __init__(self, server, port = None, use_ssl = True, cache = None):
+        '''
+        @param cache: EventCache to use to avoid parsing the same mails
+                      and invitations several times
+        '''
+        self.server = server
+        self.cache = cache
+        self.port = port
+        self.use_ssl = use_ssl
+        self.credentials = None
+        self.imap = self.open_imap()
+
+    def open_imap(self):
+        import imaplib
+        if self.use_ssl:
+            return imaplib.IMAP4_SSL(self.server, self.port or imaplib.IMAP4_SSL_PORT)
+        return imaplib.IMAP4(self.server, self.port or imaplib.IMAP4_PORT)
 
     def connect(self, login, passwd, mailbox):
+        '''
+        @raise imaplib.IMAP4.error: if the mailbox can't be selected
+        '''
+        import imaplib
+        self.credentials = (login, passwd, mailbox)
         self.imap.login(login, passwd)
-        self.imap.select(mailbox)
-
-    def get_mails_ids(self):
-        err, ids = self.imap.search(None, '(ALL)')
+        # select() returns the NO answers instead of raising them
+        typ, data = self.imap.select(mailbox)
+        if typ != 'OK':
+            raise imaplib.IMAP4.error('Failed to select %s: %s' % (mailbox, data[0]))
+
+    def reconnect(self):
+        '''
+        Opens a new IMAP session with the credentials given to connect()
+        '''
+        try:
+            self.imap.shutdown()
+        except Exception:
+            pass
+        self.imap = self.open_imap()
+        return self.connect(*self.credentials)
+
+    def get_untagged_changes(self):
+        changes = []
+        for keyword in ('EXPUNGE', 'EXISTS'):
+            typ, data = self.imap.response(keyword)
+            for number in data:
+                if number is not None:
+                    changes.append((int(number), keyword))
+        return changes
+
+    def has_buffered_data(self):
+        '''
+        imaplib reads the server responses through a buffered file: the
+        lines received together with the IDLE continuation can be waiting
+        there, where select() doesn't see them.
+        '''
+        rbuf = getattr(getattr(self.imap, 'file', None), '_rbuf', None)
+        return rbuf is not None and len(rbuf.getvalue()) > 0
+
+    def wait_for_changes(self, timeout):
+        '''
+        Waits for the mailbox to change using IMAP IDLE if the server supports
+        it, or waits timeout seconds before polling it with NOOP.
+
+        @result: list of (number, keyword) tuples for the EXISTS and EXPUNGE
+                 untagged responses received. The list is empty on timeout.
+        '''
+        import imaplib
+        # The server may have told us about changes while answering
+        # other commands
+        changes = self.get_untagged_changes()
+        if len(changes) > 0:
+            return changes
+
+        if 'IDLE' not in self.imap.capabilities:
+            time.sleep(timeout)
+            self.imap.noop()
+            return self.get_untagged_changes()
+
+        tag = self.imap._new_tag()
+        self.imap.send('%s IDLE\r\n' % tag)
+        line = self.imap.readline()
+        if not line.startswith('+'):
+            raise imaplib.IMAP4.error('IDLE refused: %s' % line.strip())
+
+        lines = []
+        sock = getattr(self.imap, 'sslobj', None) or self.imap.socket()
+        pending = getattr(sock, 'pending', lambda: 0)
+        if self.has_buffered_data() or pending() > 0 or \
+                len(select.select([sock], [], [], timeout)[0]) > 0:
+            lines.append(self.imap.readline())
+
+        self.imap.send('DONE\r\n')
+        while True:
+            line = self.imap.readline()
+            if line == '':
+                raise imaplib.IMAP4.abort('connection closed during IDLE')
+            if line.startswith(tag):
+                if line.split()[1] != 'OK':
+                    raise imaplib.IMAP4.error('IDLE failed: %s' % line.strip())
+                break
+            lines.append(line)
+
+        changes = []
+        for line in lines:
+            words = line.split()
+            if len(words) == 3 and words[0] == '*' and words[1].isdigit() and \
+                    words[2].upper() in ('EXISTS', 'EXPUNGE'):
+                changes.append((int(words[1]), words[2].upper()))
+        return changes
+
+    def get_mails_ids(self, received_since = None):
+        '''
+        @param received_since: if not None, only get the mails received
+                               since that date. Note that this is the date
+                               of the mail, not the one of the event.
+        '''
+        criteria = '(ALL)'
+        if received_since is not None:
+            months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+                      'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+            criteria = '(SINCE %d-%s-%d)' % (received_since.day,
+                                              months[received_since.month - 1],
+                                              received_since.year)
+        err, ids = self.imap.search(None, criteria)
         return ids[0].split()
 
     @staticmethod
     def get_ical_from_multipart(mail):
-        event = None
         if mail.is_multipart():
             for part in mail.get_payload():
-                if part.is_multipart():
-                    event = GWConnection.get_ical_from_multipart(part)
-                else:
-                    if part.get_content_type().startswith('text/calendar'):
-                        # We got the ical part of the multipart!
-                        event = part.get_payload()
+                event = GWConnection.get_ical_from_multipart(part)
+                if event is not None:
+                    return event
         elif mail.get_content_type().startswith('text/calendar'):
-            event = mail.get_payload()
-        return event
+            # We got the ical part of the multipart!
+            return mail.get_payload(decode = True)
+        return None
 
+    @staticmethod
+    def get_ical_from_mail(raw):
+        try:
+            return find_calendar_part(raw)
+        except MimeError:
+            import email
+            # The email parser is slower, but copes better with broken mails
+            return GWConnection.get_ical_from_multipart(email.message_from_string(raw))
 
-    def get_event(self, mail_id):
-        # TODO Caching the events would be needed,
-        # though we still need to find a way to get changed appointments
-        err, data = self.imap.fetch(mail_id, '(RFC822)')
-        mail = email.message_from_string(data[0][1])
-        ical = self.get_ical_from_multipart(mail)
-        calendar = Calendar(ical)
+    @staticmethod
+    def parse_event(ical):
         event = None
-        if len(calendar.events) > 0:
-            event = calendar.events[0]
+        if ical is not None:
+            calendar = Calendar(ical, lazy = True)
+            if len(calendar.events) > 0:
+                event = calendar.events[0]
         return event
 
-
-    def dump(self, path):
-        events = {}
-        ids = self.get_mails_ids( );
+    def get_event(self, mail_id):
+        err, data = self.imap.fetch(mail_id, '(RFC822)')
+        if self.cache is None:
+            return self.parse_event(self.get_ical_from_mail(data[0][1]))
+        return self.cache.get_event(data[0][1], self.get_ical_from_mail, self.parse_event)
+
+    def get_events(self, ids, events, updated = None):
+        '''
+        Adds the events of the ids mails to the events dictionary, keyed by
+        GroupWise record ID or UID. Only the most recent version of an
+        event, according to its dtstamp, is kept.
+
+        The events aren't windowed: an invitation moving an event out of
+        the window has to replace the older ones. Filter them when writing.
+
+        @param updated: if not None, list to which the keys of the added or
+                        replaced events are appended
+        '''
         for mail_id in ids:
             event = self.get_event(mail_id)
             if event is not None:
@@ -85,31 +219,57 @@ class GWConnection:
                     uid = event.gwrecordid
 
                 if uid is not None:
-                    if uid in events and \
+                    if uid not in events or \
                             datetime.strptime(events[uid].dtstamp, fmt) <= dtstamp:
                         events[uid] = event
-                    elif uid not in events:
-                        events[uid] = event
+                        if updated is not None:
+                            updated.append(uid)
+        return events
 
-        if path is not None:
-            dirname = os.path.dirname(path)
-            if not os.path.isdir(dirname):
-                os.makedirs(dirname)
-            fp = open(path, 'w')
-        else:
-            fp = sys.stdout
-
-        fp.write('BEGIN:VCALENDAR\r\n')
-        fp.write('PRODID:-//SUSE Hackweek//NONSGML groupwise-to-ics//EN\r\n')
-        fp.write('VERSION:2.0\r\n')
+    @staticmethod
+    def format_ics(events, since = None, until = None):
+        lines = ['BEGIN:VCALENDAR\r\n',
+                 'PRODID:-//SUSE Hackweek//NONSGML groupwise-to-ics//EN\r\n',
+                 'VERSION:2.0\r\n']
 
-        for eventid in events:
+        for eventid in sorted(events.keys()):
             event = events[eventid]
-            fp.write(event.to_ical())
+            if event.overlaps(since, until):
+                lines.append(event.to_ical())
 
-        fp.write('END:VCALENDAR\r\n')
-        if path is not None:
-            fp.close()
+        lines.append('END:VCALENDAR\r\n')
+        return ''.join(lines)
+
+    @staticmethod
+    def write_ics(content, path):
+        '''
+        Writes the ICS content to path, or to stdout if path is None.
+        The file is replaced atomically so readers never get a partial calendar.
+        '''
+        if path is None:
+            sys.stdout.write(content)
+            return
+
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp_path = '%s.tmp' % path
+        fp = open(tmp_path, 'wb')
+        fp.write(content)
+        fp.close()
+        os.rename(tmp_path, path)
+
+    def dump(self, path, since = None, until = None, received_since = None):
+        '''
+        Writes the events to the path ICS file, or to stdout if path is None.
+        Only the events overlapping the [since, until) window of naive UTC
+        datetimes are written. received_since is passed to get_mails_ids().
+
+        @result: the events dictionary built by get_events()
+        '''
+        events = self.get_events(self.get_mails_ids(received_since), {})
+        self.write_ics(self.format_ics(events, since, until), path)
+        return events
 
 class SoapException(Exception):
     def __init__(self, msg):
@@ -117,15 +277,107 @@ class SoapException(Exception):
     def __str__(self):
         return self.msg
 
+class ItemIds(object):
+    '''
+    GroupWise ids of the items created from the calendar, by uid. The changes
+    are appended to a file, so that the items created before a restart are
+    modified rather than created again. The file is compacted when loaded.
+
+    It can be shared by several GwSoapClient as long as the changes of an
+    uid are made by one of them at a time, like with a PushPipeline.
+    '''
+    # Item id of the records of removed uids
+    REMOVED = '-'
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.ids = {}
+        if os.path.isfile(path):
+            fp = open(path, 'rb')
+            try:
+                for line in fp:
+                    self.load_record(line)
+            finally:
+                fp.close()
+
+        # Rewrite the file with only the current ids
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        os.fchmod(fd, 0600)
+        fp = os.fdopen(fd, 'wb')
+        for uid in self.ids:
+            fp.write(ItemIds.format_record(uid, self.ids[uid]))
+        fp.close()
+        os.rename(tmp_path, path)
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+
+    @staticmethod
+    def format_record(uid, itemid):
+        # string_escape keeps the tabs and line breaks out of the fields
+        return '%s\t%s\n' % (uid.encode('string_escape'), itemid.encode('string_escape'))
+
+    def load_record(self, line):
+        fields = line.rstrip('\n').split('\t')
+        try:
+            if not line.endswith('\n') or len(fields) != 2:
+                raise ValueError('not an uid and an item id')
+            (uid, itemid) = [field.decode('string_escape') for field in fields]
+        except ValueError, e:
+            # The last record may be truncated if the process was killed
+            print 'Ignoring invalid record in %s (%s)' % (self.path, e)
+            return
+        if itemid == ItemIds.REMOVED:
+            self.ids.pop(uid, None)
+        else:
+            self.ids[uid] = itemid
+
+    def get(self, uid, default = None):
+        with self.lock:
+            return self.ids.get(uid, default)
+
+    def __setitem__(self, uid, itemid):
+        with self.lock:
+            self.ids[uid] = itemid
+        # Appends are atomic: the workers don't need to wait for each other
+        os.write(self.fd, ItemIds.format_record(uid, itemid))
+
+    def pop(self, uid, default = None):
+        with self.lock:
+            if uid not in self.ids:
+                return default
+            itemid = self.ids.pop(uid)
+        os.write(self.fd, ItemIds.format_record(uid, ItemIds.REMOVED))
+        return itemid
+
+    def close(self):
+        os.close(self.fd)
+
 class GwSoapClient(object):
-    def __init__(self, server, port, username, passwd):
+    def __init__(self, server, port, username, passwd, use_ssl = True, path = '/soap',
+                 folder = 'Calendar', ids = None):
+        '''
+        @param folder: name of the folder where to create the appointments
+        @param ids: ItemIds to use, or None to only keep the ids of the items
+                    created by this client in memory
+        '''
         self.server = server
         self.port = port
         self.username = username
         self.passwd = passwd
+        self.path = path
+        self.folder = folder
         self.session = None
-
-        self.http = httplib.HTTPSConnection(server, port)
+        self.container = None
+        if ids is None:
+            ids = {}
+        self.ids = ids
+
+        import httplib
+        if use_ssl:
+            self.http = httplib.HTTPSConnection(server, port)
+        else:
+            self.http = httplib.HTTPConnection(server, port)
 
     def createEnvelope(self, request):
 
@@ -147,12 +399,42 @@ class GwSoapClient(object):
         headers = {'SOAPAction': request, \
                    'Content-Type': 'text/xml;charset=utf-8'}
         envelope = self.createEnvelope(body)
-        self.http.request('POST', '/soap', envelope, headers)
-
-        response = self.http.getresponse()
-        response_body = response.read()
+        try:
+            self.http.request('POST', self.path, envelope, headers)
+
+            response = self.http.getresponse()
+            response_body = response.read()
+        except Exception:
+            # The next request will open a new connection
+            self.http.close()
+            raise
+        if response.status != 200:
+            raise SoapException('%s failed: HTTP %d %s' % (request, response.status, response.reason))
         return response_body
 
+    def call(self, request, body):
+        '''
+        Sends a request, login in first if needed.
+
+        @result: the root element of the response
+        @raise SoapException: if GroupWise returns an error status
+        '''
+        import xml.etree.ElementTree as ET
+        if self.session is None:
+            self.connect()
+
+        root = ET.fromstring(self.request(request, body))
+        ns = {'gwm': 'http://schemas.novell.com/2005/01/GroupWise/methods', \
+              'gwt': 'http://schemas.novell.com/2005/01/GroupWise/types'}
+        codes = root.findall('.//gwm:status/gwt:code', ns)
+        if len(codes) > 0 and codes[0].text.strip() != '0':
+            descriptions = root.findall('.//gwm:status/gwt:description', ns)
+            description = codes[0].text.strip()
+            if len(descriptions) > 0:
+                description = descriptions[0].text
+            raise SoapException('%s failed: %s' % (request, description))
+        return root
+
     def connect(self):
         if self.session is not None:
             # Already connected
@@ -168,6 +450,7 @@ class GwSoapClient(object):
 
         response = self.request('loginRequest', login_request)
 
+        import xml.etree.ElementTree as ET
         root = ET.fromstring(response)
         ns = {'gwm': 'http://schemas.novell.com/2005/01/GroupWise/methods', \
               'gwt': 'http://schemas.novell.com/2005/01/GroupWise/types'}
@@ -204,6 +487,7 @@ class GwSoapClient(object):
         request = '<ns2:getFolderListRequest><ns2:parent>%s</ns2:parent></ns2:getFolderListRequest>' % parent_id
         response = self.request('getFolderListRequest', request)
 
+        import xml.etree.ElementTree as ET
         root = ET.fromstring(response)
         ns = {'gwm': 'http://schemas.novell.com/2005/01/GroupWise/methods', \
               'gwt': 'http://schemas.novell.com/2005/01/GroupWise/types'}
@@ -215,3 +499,86 @@ class GwSoapClient(object):
                 result = folder.findall('./gwt:id', ns)[0].text
                 break
         return result
+
+    @staticmethod
+    def format_appointment(event):
+        '''
+        @result: the fields of the GroupWise appointment matching the event
+        '''
+        import base64
+        from xml.sax.saxutils import escape
+        fmt = '%Y-%m-%dT%H:%M:%SZ'
+        fields = []
+        if event.summary is not None:
+            fields.append('<ns1:subject>%s</ns1:subject>' % escape(event.summary))
+        if event.description is not None:
+            fields.append('<ns1:message><ns1:part contentType="text/plain">%s</ns1:part></ns1:message>' %
+                          base64.b64encode(event.description))
+        if event.uid is not None:
+            fields.append('<ns1:iCalId>%s</ns1:iCalId>' % escape(event.uid))
+        interval = event.get_interval()
+        if interval is not None:
+            fields.append('<ns1:startDate>%s</ns1:startDate>' % interval[0].strftime(fmt))
+            fields.append('<ns1:endDate>%s</ns1:endDate>' % interval[1].strftime(fmt))
+        if event.location is not None:
+            fields.append('<ns1:place>%s</ns1:place>' % escape(event.location))
+        return ''.join(fields)
+
+    def get_container(self):
+        if self.container is None:
+            self.container = self.get_folder_id(None, self.folder)
+            if self.container is None:
+                raise SoapException('No %s folder' % self.folder)
+        return self.container
+
+    def create_appointment(self, event):
+        '''
+        @result: the id of the created item
+        '''
+        request = '<ns2:createItemRequest><ns2:item xsi:type="ns1:Appointment">' \
+                  '<ns1:container>%s</ns1:container>%s</ns2:item></ns2:createItemRequest>' % \
+                  (self.get_container(), self.format_appointment(event))
+        root = self.call('createItemRequest', request)
+        ns = {'gwm': 'http://schemas.novell.com/2005/01/GroupWise/methods'}
+        ids = root.findall('.//gwm:createItemResponse/gwm:id', ns)
+        if len(ids) == 0:
+            raise SoapException('createItemRequest failed: no item id')
+        return ids[0].text
+
+    def modify_appointment(self, itemid, event):
+        request = '<ns2:modifyItemRequest><ns2:id>%s</ns2:id><ns2:updates><ns1:update>%s' \
+                  '</ns1:update></ns2:updates></ns2:modifyItemRequest>' % \
+                  (itemid, self.format_appointment(event))
+        self.call('modifyItemRequest', request)
+
+    def remove_item(self, itemid):
+        request = '<ns2:removeItemRequest><ns2:container>%s</ns2:container>' \
+                  '<ns2:id>%s</ns2:id></ns2:removeItemRequest>' % (self.get_container(), itemid)
+        self.call('removeItemRequest', request)
+
+    def push_event(self, kind, uid, value):
+        '''
+        Applies a change found by streamdiff.diff_files to GroupWise.
+
+        @param kind: 'changed', 'removed' or 'added'
+        @param value: the event for added and removed changes, or a
+                      dictionary with the 'old' and 'new' events
+        '''
+        if kind == 'changed':
+            (old, event) = (value['old'], value['new'])
+        else:
+            (old, event) = (value, value)
+        itemid = event.gwrecordid or old.gwrecordid or self.ids.get(uid)
+
+        if kind == 'removed':
+            if itemid is None:
+                print 'No GroupWise item for %s: nothing to remove' % uid
+                return
+            self.remove_item(itemid)
+            self.ids.pop(uid, None)
+        elif itemid is not None:
+            # Added events already have an item when a push is retried
+            self.modify_appointment(itemid, event)
+        else:
+            # Events changed before being pushed to GroupWise are created
+            self.ids[uid] = self.create_appointment(event)
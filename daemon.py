@@ -0,0 +1,184 @@
+# groupwise-ics: synchronize GroupWise calendar to ICS file and back
+# Copyright (C) 2013  Cedric Bosdonnat <cedric@bosdonnat.fr>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import imaplib
+import os.path
+import socket
+import time
+from cal import parse_date
+from connection import GWConnection
+from freebusy import FreeBusy
+from shards import write_shards
+
+class SyncDaemon(object):
+    '''
+    Keeps an ICS file in sync with a GroupWise mailbox over a long-lived
+    IMAP session. Only the mails arriving in the mailbox are fetched and
+    parsed, and the file is rewritten only if its content changes.
+    '''
+    def __init__(self, connection, path, since = None, until = None,
+                 idle_timeout = 25 * 60, min_backoff = 1, max_backoff = 300,
+                 freebusy_path = None, freebusy_format = 'ics',
+                 shard_dir = None, shard_size = None):
+        '''
+        @param connection: connected GWConnection
+        @param since: window start as accepted by cal.parse_date. Relative
+                      values like -7d are evaluated again at each write.
+        @param until: window end, like since
+        @param freebusy_path: if not None, also keep the free/busy time
+                              up to date in that file
+        @param freebusy_format: 'ics' for VFREEBUSY or 'binary'
+        @param shard_dir: if not None, also keep the shards written by
+                          shards.write_shards up to date in that directory
+        @param shard_size: number of events per shard, or None for
+                           monthly shards
+        @param idle_timeout: seconds to wait for a change before restarting
+                             IDLE or polling the server with NOOP
+        @param min_backoff: seconds to wait before the first reconnection
+                            attempt, doubled after each failure
+        @param max_backoff: maximum number of seconds between reconnections
+        '''
+        self.connection = connection
+        self.path = path
+        self.since = since
+        self.until = until
+        self.idle_timeout = idle_timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+
+        self.freebusy_path = freebusy_path
+        self.freebusy_format = freebusy_format
+        self.shard_dir = shard_dir
+        self.shard_size = shard_size
+        self.shards_checked = False
+
+        self.events = {}
+        self.freebusy = FreeBusy()
+        self.freebusy_periods = None
+        self.count = 0
+        self.writes = 0
+        self.running = False
+
+        # Don't rewrite an up to date file when starting
+        self.content = None
+        if os.path.isfile(path):
+            fp = open(path, 'r')
+            self.content = fp.read()
+            fp.close()
+
+    def full_sync(self):
+        ids = self.connection.get_mails_ids()
+        self.events = self.connection.get_events(ids, {})
+        self.freebusy = FreeBusy()
+        self.freebusy.update(self.events, self.events.keys())
+        self.count = len(ids)
+        self.write()
+
+    def sync(self, count):
+        '''
+        Adds the events of the mails after the last processed one, up to
+        the count mail.
+        '''
+        ids = [str(mail_id) for mail_id in range(self.count + 1, count + 1)]
+        updated = []
+        self.connection.get_events(ids, self.events, updated)
+        self.freebusy.update(self.events, updated)
+        self.count = count
+        self.write()
+
+    def get_window(self):
+        '''
+        @result: the (since, until) naive UTC datetimes of the window
+        '''
+        window = []
+        for value in (self.since, self.until):
+            if value is not None:
+                value = parse_date(value)
+            window.append(value)
+        return tuple(window)
+
+    def write(self):
+        (since, until) = self.get_window()
+        content = GWConnection.format_ics(self.events, since, until)
+        # Shards are checked at least once as they may be missing even
+        # if the ICS file is up to date
+        if self.shard_dir is not None and \
+                (content != self.content or not self.shards_checked):
+            write_shards(self.events, self.shard_dir, self.shard_size,
+                         since, until)
+            self.shards_checked = True
+
+        if content != self.content:
+            GWConnection.write_ics(content, self.path)
+            self.content = content
+            self.writes += 1
+
+        if self.freebusy_path is not None:
+            # The VFREEBUSY DTSTAMP always changes: compare the periods
+            periods = self.freebusy.get_all_periods(since, until)
+            if periods != self.freebusy_periods:
+                content = self.freebusy.serialize(self.freebusy_format, since, until)
+                GWConnection.write_ics(content, self.freebusy_path)
+                self.freebusy_periods = periods
+
+    def apply_changes(self, changes):
+        expunged = False
+        count = self.count
+        for (number, keyword) in changes:
+            if keyword == 'EXPUNGE':
+                expunged = True
+            else:
+                count = number
+
+        if expunged:
+            # Sequence numbers have been shifted and events may have vanished
+            self.full_sync()
+        elif count > self.count:
+            self.sync(count)
+
+    def stop(self):
+        '''
+        Makes run() return after the current wait for changes.
+        '''
+        self.running = False
+
+    def run(self):
+        self.running = True
+        connected = True
+        needs_sync = True
+        backoff = self.min_backoff
+
+        while self.running:
+            try:
+                if not connected:
+                    self.connection.reconnect()
+                    connected = True
+                    needs_sync = True
+                if needs_sync:
+                    self.full_sync()
+                    needs_sync = False
+                    backoff = self.min_backoff
+                changes = self.connection.wait_for_changes(self.idle_timeout)
+                if len(changes) > 0:
+                    self.apply_changes(changes)
+                else:
+                    # Relative windows move even without new invitations
+                    self.write()
+            except (imaplib.IMAP4.error, socket.error), e:
+                print 'Connection to %s lost (%s): reconnecting in %g seconds' % \
+                        (self.connection.server, e, backoff)
+                connected = False
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
@@ -0,0 +1,210 @@
+# groupwise-ics: synchronize GroupWise calendar to ICS file and back
+# Copyright (C) 2013  Cedric Bosdonnat <cedric@bosdonnat.fr>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import bisect
+import calendar
+import datetime
+import struct
+
+BUSY = 'BUSY'
+BUSY_TENTATIVE = 'BUSY-TENTATIVE'
+FBTYPES = [BUSY, BUSY_TENTATIVE]
+
+# Binary format: header followed by (start, end, fbtype) records where the
+# dates are seconds since the epoch and fbtype the index in FBTYPES
+BINARY_MAGIC = 'GWFB'
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct('<4sBI')
+BINARY_RECORD = struct.Struct('<qqB')
+
+def get_fbtype(event):
+    '''
+    @result: the FBTYPE of the event or None if it doesn't make its
+             attendees busy.
+    '''
+    status = (event.status or '').upper()
+    if status == 'CANCELLED':
+        return None
+    for line in event.lines:
+        if line.upper().startswith('TRANSP:') and \
+                line[len('TRANSP:'):].strip().upper() == 'TRANSPARENT':
+            return None
+    if status == 'TENTATIVE':
+        return BUSY_TENTATIVE
+    return BUSY
+
+def merge_intervals(intervals):
+    '''
+    @param intervals: list of (start, end, ...) tuples sorted by start
+    @result: list of (start, end) tuples of the merged overlapping or
+             adjacent intervals
+    '''
+    merged = []
+    for interval in intervals:
+        (start, end) = interval[:2]
+        if len(merged) > 0 and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+class FreeBusy(object):
+    '''
+    Busy time of a calendar, computed from the UTC start and end of its
+    events. Recurring events only count for their first occurrence.
+
+    The intervals of each event are kept sorted by start time, so that
+    updating a few events doesn't require to parse or sort all of them
+    again. The merged periods of each FBTYPE are cached until one of its
+    events changes.
+    '''
+    def __init__(self):
+        self.by_uid = {}
+        self.intervals = {}
+        self.periods = {}
+        for fbtype in FBTYPES:
+            self.intervals[fbtype] = []
+
+    def remove_event(self, uid):
+        if uid not in self.by_uid:
+            return
+        (fbtype, start, end) = self.by_uid.pop(uid)
+        intervals = self.intervals[fbtype]
+        intervals.pop(bisect.bisect_left(intervals, (start, end, uid)))
+        self.periods.pop(fbtype, None)
+
+    def set_event(self, uid, event):
+        '''
+        Adds, replaces or removes the event with the uid key. Events not
+        making their attendees busy or None are removed.
+        '''
+        self.remove_event(uid)
+        if event is None:
+            return
+        fbtype = get_fbtype(event)
+        interval = event.get_interval()
+        if fbtype is None or interval is None or interval[0] == interval[1]:
+            return
+        (start, end) = interval
+        self.by_uid[uid] = (fbtype, start, end)
+        bisect.insort(self.intervals[fbtype], (start, end, uid))
+        self.periods.pop(fbtype, None)
+
+    def update(self, events, uids):
+        '''
+        Refreshes the events with the uids keys in the events dictionary.
+        Keys missing in the dictionary are removed.
+        '''
+        for uid in uids:
+            self.set_event(uid, events.get(uid))
+
+    def get_periods(self, fbtype):
+        if fbtype not in self.periods:
+            self.periods[fbtype] = merge_intervals(self.intervals[fbtype])
+        return self.periods[fbtype]
+
+    def get_all_periods(self, since = None, until = None):
+        '''
+        @result: dictionary of the merged (start, end) periods by FBTYPE,
+                 clipped to the [since, until) window
+        '''
+        result = {}
+        for fbtype in FBTYPES:
+            periods = []
+            for (start, end) in self.get_periods(fbtype):
+                if since is not None:
+                    start = max(start, since)
+                if until is not None:
+                    end = min(end, until)
+                if start < end:
+                    periods.append((start, end))
+            result[fbtype] = periods
+        return result
+
+    def to_ical(self, since = None, until = None):
+        fmt = '%Y%m%dT%H%M%SZ'
+        all_periods = self.get_all_periods(since, until)
+
+        bounds = [period for fbtype in FBTYPES for period in all_periods[fbtype]]
+        if since is None and len(bounds) > 0:
+            since = min([start for (start, end) in bounds])
+        if until is None and len(bounds) > 0:
+            until = max([end for (start, end) in bounds])
+
+        lines = ['BEGIN:VCALENDAR',
+                 'PRODID:-//SUSE Hackweek//NONSGML groupwise-to-ics//EN',
+                 'VERSION:2.0',
+                 'METHOD:PUBLISH',
+                 'BEGIN:VFREEBUSY',
+                 'DTSTAMP:%s' % datetime.datetime.utcnow().strftime(fmt)]
+        if since is not None:
+            lines.append('DTSTART:%s' % since.strftime(fmt))
+        if until is not None:
+            lines.append('DTEND:%s' % until.strftime(fmt))
+
+        for fbtype in FBTYPES:
+            periods = ['%s/%s' % (start.strftime(fmt), end.strftime(fmt))
+                       for (start, end) in all_periods[fbtype]]
+            if len(periods) > 0:
+                lines.append(fold('FREEBUSY;FBTYPE=%s:%s' % (fbtype, ','.join(periods))))
+
+        lines.extend(['END:VFREEBUSY', 'END:VCALENDAR', ''])
+        return '\r\n'.join(lines)
+
+    def to_binary(self, since = None, until = None):
+        all_periods = self.get_all_periods(since, until)
+        records = []
+        for (index, fbtype) in enumerate(FBTYPES):
+            for (start, end) in all_periods[fbtype]:
+                records.append(BINARY_RECORD.pack(calendar.timegm(start.utctimetuple()),
+                                                  calendar.timegm(end.utctimetuple()),
+                                                  index))
+        header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(records))
+        return header + ''.join(records)
+
+    def serialize(self, format, since = None, until = None):
+        '''
+        @param format: 'ics' or 'binary'
+        '''
+        if format == 'binary':
+            return self.to_binary(since, until)
+        return self.to_ical(since, until)
+
+def fold(line):
+    '''
+    Folds a content line to 75 octets as required by RFC 5545
+    '''
+    chunks = [line[:75]]
+    for pos in range(75, len(line), 74):
+        chunks.append(' ' + line[pos:pos + 74])
+    return '\r\n'.join(chunks)
+
+def read_binary(data):
+    '''
+    @result: list of (start, end, fbtype) tuples read from data written by
+             FreeBusy.to_binary, with naive UTC datetimes
+    '''
+    (magic, version, count) = BINARY_HEADER.unpack_from(data)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError('Not a free/busy binary file')
+    result = []
+    for index in range(count):
+        offset = BINARY_HEADER.size + index * BINARY_RECORD.size
+        (start, end, fbtype) = BINARY_RECORD.unpack_from(data, offset)
+        result.append((datetime.datetime.utcfromtimestamp(start),
+                       datetime.datetime.utcfromtimestamp(end),
+                       FBTYPES[fbtype]))
+    return result
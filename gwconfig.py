@@ -0,0 +1,80 @@
+# groupwise-ics: synchronize GroupWise calendar to ICS file and back
+# Copyright (C) 2013  Cedric Bosdonnat <cedric@bosdonnat.fr>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+KEYS = ['imap', 'login', 'password', 'soap']
+
+class ConfigError(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+    def __str__(self):
+        return self.msg
+
+def is_comment(line):
+    return line == '' or line.startswith('#') or line.startswith(';')
+
+def is_ini(content):
+    for line in content.splitlines():
+        line = line.strip()
+        if not is_comment(line):
+            return line.startswith('[')
+    return False
+
+def parse_ini(content, path = None):
+    '''
+    Parses the simple INI files ConfigParser.RawConfigParser reads, without
+    its multi-line values: importing and running it costs more than
+    executing a python file.
+
+    @result: dictionary of the options dictionaries by section name
+    '''
+    sections = {}
+    section = None
+    for (lineno, line) in enumerate(content.splitlines()):
+        line = line.strip()
+        if is_comment(line):
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            section = sections.setdefault(line[1:-1].strip(), {})
+            continue
+        pos = min([index for index in (line.find('='), line.find(':')) if index >= 0] or [-1])
+        if section is None or pos <= 0:
+            raise ConfigError('%s:%d: invalid line: %s' % (path, lineno + 1, line))
+        section[line[:pos].strip().lower()] = line[pos + 1:].strip()
+    return sections
+
+def load_config(path):
+    '''
+    Reads the GroupWise connection details from path. The file can either
+    be an INI file with a [gw] section, or the python file defining a gw
+    dictionary used by older versions.
+
+    @result: dictionary with the imap, login, password and soap keys, set
+             to None when missing from the file
+    '''
+    fp = open(path, 'r')
+    content = fp.read()
+    fp.close()
+
+    result = dict([(key, None) for key in KEYS])
+    if is_ini(content):
+        section = parse_ini(content, path).get('gw', {})
+        for key in KEYS:
+            result[key] = section.get(key)
+    else:
+        config = {}
+        exec compile(content, path, 'exec') in {}, config
+        result.update(config.get('gw', {}))
+    return result
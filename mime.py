@@ -0,0 +1,140 @@
+# groupwise-ics: synchronize GroupWise calendar to ICS file and back
+# Copyright (C) 2013  Cedric Bosdonnat <cedric@bosdonnat.fr>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import binascii
+import re
+
+BOUNDARY_RE = re.compile(r'boundary\s*=\s*(?:"([^"]*)"|([^;\s]+))', re.IGNORECASE)
+
+class MimeError(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+    def __str__(self):
+        return self.msg
+
+def split_headers(raw):
+    '''
+    @result: (headers, body) where headers is a dictionary of the
+             Content-Type and Content-Transfer-Encoding headers, keyed
+             by lower case name
+    '''
+    crlf = raw.find('\r\n\r\n')
+    lf = raw.find('\n\n')
+    if crlf >= 0 and (lf < 0 or crlf < lf):
+        (header_block, body) = (raw[:crlf], raw[crlf + 4:])
+    elif lf >= 0:
+        (header_block, body) = (raw[:lf], raw[lf + 2:])
+    else:
+        (header_block, body) = (raw, '')
+
+    headers = {}
+    name = None
+    for line in header_block.split('\n'):
+        line = line.rstrip('\r')
+        if line.startswith(' ') or line.startswith('\t'):
+            # Folded header line
+            if name is not None:
+                headers[name] += ' ' + line.strip()
+            continue
+
+        pos = line.find(':')
+        name = None
+        if pos > 0:
+            key = line[:pos].strip().lower()
+            if key in ('content-type', 'content-transfer-encoding'):
+                name = key
+                headers[name] = line[pos + 1:].strip()
+    return (headers, body)
+
+def decode_body(body, encoding):
+    encoding = encoding.lower()
+    try:
+        if encoding == 'base64':
+            return binascii.a2b_base64(body)
+        if encoding == 'quoted-printable':
+            return binascii.a2b_qp(body)
+    except binascii.Error, e:
+        raise MimeError('Invalid %s content: %s' % (encoding, e))
+    return body
+
+def split_parts(body, boundary):
+    '''
+    Iterates over the parts of a multipart body, without their delimiters
+    '''
+    delimiter = '--' + boundary
+    # The delimiter has to be at the start of a line
+    pos = -1
+    if body.startswith(delimiter):
+        pos = 0
+    else:
+        pos = body.find('\n' + delimiter)
+        if pos >= 0:
+            pos += 1
+
+    while pos >= 0:
+        end_of_delimiter = pos + len(delimiter)
+        if body.startswith('--', end_of_delimiter):
+            # Closing delimiter
+            return
+
+        # Skip the rest of the delimiter line
+        start = body.find('\n', end_of_delimiter)
+        if start < 0:
+            raise MimeError('Truncated multipart body')
+        start += 1
+
+        next_pos = body.find('\n' + delimiter, start - 1)
+        if next_pos < 0:
+            raise MimeError('Missing closing boundary: %s' % boundary)
+
+        # The line break before the delimiter belongs to it
+        end = next_pos
+        if end > start and body[end - 1] == '\r':
+            end -= 1
+        yield body[start:max(start, end)]
+        pos = next_pos + 1
+
+def find_calendar_part(raw):
+    '''
+    Searches the first text/calendar part of a raw mail by only looking at
+    the headers needed to walk through the multipart structure.
+
+    @result: the decoded payload of the part or None if there is none
+    @raise MimeError: if the mail is malformed
+    '''
+    (headers, body) = split_headers(raw)
+    content_type = headers.get('content-type', 'text/plain')
+    main_type = content_type.split(';')[0].strip().lower()
+
+    if main_type == 'text/calendar':
+        return decode_body(body, headers.get('content-transfer-encoding', '7bit'))
+
+    if main_type == 'message/rfc822':
+        # Invitations forwarded as attachments
+        return find_calendar_part(decode_body(body, headers.get('content-transfer-encoding', '7bit')))
+
+    if main_type.startswith('multipart/'):
+        match = BOUNDARY_RE.search(content_type)
+        if match is None:
+            raise MimeError('Multipart without boundary')
+        boundary = match.group(1)
+        if boundary is None:
+            boundary = match.group(2)
+
+        for part in split_parts(body, boundary):
+            payload = find_calendar_part(part)
+            if payload is not None:
+                return payload
+    return None
@@ -0,0 +1,302 @@
+# groupwise-ics: synchronize GroupWise calendar to ICS file and back
+# Copyright (C) 2013  Cedric Bosdonnat <cedric@bosdonnat.fr>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import Queue
+# datetime.strptime imports it on first use, which fails if several
+# workers parse dates at the same time
+import _strptime
+import os
+import os.path
+import shutil
+import threading
+import time
+from streamdiff import diff_files, get_fingerprint
+
+class Batch(object):
+    '''
+    Changes found by one diff of the calendar. The batch is finished once
+    all its changes are pushed or given up.
+    '''
+    def __init__(self, size, data = None):
+        self.remaining = size
+        self.data = data
+        self.failed = False
+        self.discarded = False
+        self.created = time.time()
+        # (kind, uid, value) changes successfully pushed
+        self.pushed = []
+
+    def is_finished(self):
+        return self.remaining == 0
+
+class PushPipeline(object):
+    '''
+    Pushes changes with a pool of worker threads. All the changes of an uid
+    are handled by the same worker, so that they are pushed in the order
+    they were submitted, while the changes of different uids are pushed
+    concurrently.
+    '''
+    def __init__(self, create_push, workers = 4, queue_size = 256, retries = 3,
+                 min_backoff = 1, max_backoff = 60):
+        '''
+        @param create_push: called by each worker to get the function pushing
+                            a (kind, uid, value) change, which raises an
+                            exception on failure. Workers don't share it, so
+                            it can hold a connection.
+        @param queue_size: maximum number of changes waiting for a worker.
+                           submit() blocks when it is reached.
+        @param retries: number of times a failed push is attempted again
+        @param min_backoff: seconds to wait before the first retry, doubled
+                            after each failure
+        @param max_backoff: maximum number of seconds between retries
+        '''
+        self.create_push = create_push
+        self.retries = retries
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.queues = [Queue.Queue(queue_size) for i in range(workers)]
+        self.threads = []
+        self.lock = threading.Lock()
+        self.batches = []
+        self.in_flight = 0
+        self.pushed = 0
+        self.failed = 0
+        self.retried = 0
+
+    def start(self):
+        for queue in self.queues:
+            thread = threading.Thread(target = self.work, args = (queue,))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        '''
+        Waits for the submitted changes to be handled and stops the workers
+        '''
+        for queue in self.queues:
+            queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def submit(self, changes, data = None):
+        '''
+        Queues the (kind, uid, value) changes as a new batch. Blocks while
+        the queue of one of the workers is full.
+
+        @param data: value kept in the batch for the caller
+        @result: the created Batch
+        '''
+        batch = Batch(len(changes), data)
+        with self.lock:
+            self.batches.append(batch)
+        for (kind, uid, value) in changes:
+            self.queues[hash(uid) % len(self.queues)].put((batch, kind, uid, value))
+        return batch
+
+    def work(self, queue):
+        push = self.create_push()
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            (batch, kind, uid, value) = item
+            with self.lock:
+                self.in_flight += 1
+            if not batch.discarded:
+                if self.push(push, kind, uid, value):
+                    batch.pushed.append((kind, uid, value))
+                else:
+                    batch.failed = True
+            with self.lock:
+                self.in_flight -= 1
+                batch.remaining -= 1
+
+    def push(self, push, kind, uid, value):
+        '''
+        @result: whether the change could be pushed
+        '''
+        backoff = self.min_backoff
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                with self.lock:
+                    self.retried += 1
+            try:
+                push(kind, uid, value)
+                with self.lock:
+                    self.pushed += 1
+                return True
+            except Exception, e:
+                print 'Failed to push %s event %s (%s)' % (kind, uid, e)
+        with self.lock:
+            self.failed += 1
+        return False
+
+    def pop_finished(self):
+        '''
+        @result: the finished batches, in submission order. A batch finished
+                 before an older one is only returned with it.
+        '''
+        finished = []
+        with self.lock:
+            while len(self.batches) > 0 and self.batches[0].is_finished():
+                finished.append(self.batches.pop(0))
+        return finished
+
+    def discard(self):
+        '''
+        Gives up the unfinished batches: their changes still waiting for
+        a worker won't be pushed.
+
+        @result: the discarded batches
+        '''
+        with self.lock:
+            discarded = self.batches
+            self.batches = []
+        for batch in discarded:
+            batch.discarded = True
+        return discarded
+
+    def get_metrics(self):
+        '''
+        @result: dictionary with the number of 'queued' changes waiting for a
+                 worker, of 'in_flight' ones being pushed, of unfinished
+                 'batches', the 'lag' in seconds since the oldest unfinished
+                 batch was submitted and the 'pushed', 'failed' and 'retried'
+                 counters.
+        '''
+        with self.lock:
+            unfinished = [batch for batch in self.batches if not batch.is_finished()]
+            lag = 0
+            if len(unfinished) > 0:
+                lag = time.time() - unfinished[0].created
+            return {'queued': sum([queue.qsize() for queue in self.queues]),
+                    'in_flight': self.in_flight,
+                    'batches': len(unfinished),
+                    'lag': lag,
+                    'pushed': self.pushed,
+                    'failed': self.failed,
+                    'retried': self.retried}
+
+class CalendarPusher(object):
+    '''
+    Pushes the changes of a calendar file through a PushPipeline. The cached
+    calendar, against which the changes are searched, is only replaced once
+    all the changes found until then are pushed.
+
+    Each version of the calendar is copied to a snapshot next to the cached
+    calendar and compared to the previous snapshot, so that the changes
+    still being pushed aren't found again. If some changes can't be pushed,
+    the unfinished batches are discarded: the next version of the calendar
+    is compared to the cached calendar and the failed changes pushed again.
+    The changes of these batches which were pushed are remembered to avoid
+    sending them again.
+
+    The methods are meant to be called from a single thread.
+    '''
+    def __init__(self, old_path, pipeline, memory_budget = 64 * 1024 * 1024):
+        '''
+        @param pipeline: started PushPipeline, or None to only print the changes
+        '''
+        self.old_path = old_path
+        self.pipeline = pipeline
+        self.memory_budget = memory_budget
+        self.base = old_path
+        self.snapshots = 0
+        # Fingerprints of the events pushed since the cached calendar was
+        # replaced, or None for removed ones, by uid
+        self.pushed = {}
+
+    def calendar_changed(self, path):
+        self.roll_forward()
+
+        # The calendar can change again while the changes are pushed
+        self.snapshots += 1
+        snapshot = '%s.pending-%d' % (self.old_path, self.snapshots)
+        shutil.copy(path, snapshot)
+
+        # Diff the calendars without loading them: they can be huge
+        changes = []
+        counts = {'changed': 0, 'removed': 0, 'added': 0, 'unchanged': 0}
+        for (kind, uid, value) in diff_files(self.base, snapshot, self.memory_budget):
+            if self.is_pushed(kind, uid, value):
+                kind = 'unchanged'
+            counts[kind] += 1
+            if kind == 'removed':
+                # The base snapshot may be gone when the change is pushed
+                changes.append((kind, uid, value.load()))
+            elif kind != 'unchanged':
+                changes.append((kind, uid, value))
+
+        # TODO Email the changes
+        print 'Processing calendar change: (changed: %d, removed: %d, added: %d, unchanged: %d)' % \
+                (counts['changed'], counts['removed'], counts['added'], counts['unchanged'])
+
+        if self.pipeline is None:
+            print "No GroupWise connection defined: unable to push the changes"
+            os.remove(snapshot)
+            return
+
+        self.pipeline.submit(changes, snapshot)
+        self.base = snapshot
+        self.roll_forward()
+
+        metrics = self.pipeline.get_metrics()
+        print 'Push queue: %d queued, %d in flight, %d batches, lag %.1fs' % \
+                (metrics['queued'], metrics['in_flight'], metrics['batches'], metrics['lag'])
+
+    def is_pushed(self, kind, uid, value):
+        '''
+        @result: whether the change was already pushed by a discarded batch
+        '''
+        if uid not in self.pushed or kind == 'unchanged':
+            return False
+        if kind == 'removed':
+            return self.pushed[uid] is None
+        if kind == 'changed':
+            value = value['new']
+        return self.pushed[uid] == get_fingerprint(value)
+
+    def roll_forward(self):
+        '''
+        Replaces the cached calendar by the snapshot of the last pushed
+        batch, once all the older batches are pushed too.
+        '''
+        if self.pipeline is None:
+            return
+        finished = self.pipeline.pop_finished()
+        for (index, batch) in enumerate(finished):
+            if batch.failed:
+                print 'Some changes couldn\'t be pushed: retrying with the next calendar change'
+                for dropped in finished[index:] + self.pipeline.discard():
+                    for (kind, uid, value) in dropped.pushed:
+                        if kind == 'removed':
+                            self.pushed[uid] = None
+                        elif kind == 'changed':
+                            self.pushed[uid] = get_fingerprint(value['new'])
+                        else:
+                            self.pushed[uid] = get_fingerprint(value)
+                    if os.path.isfile(dropped.data):
+                        os.remove(dropped.data)
+                self.base = self.old_path
+                return
+            os.rename(batch.data, self.old_path)
+            # The cached calendar now has the changes pushed before
+            self.pushed = {}
+            if self.base == batch.data:
+                self.base = self.old_path
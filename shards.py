@@ -0,0 +1,114 @@
+# groupwise-ics: synchronize GroupWise calendar to ICS file and back
+# Copyright (C) 2013  Cedric Bosdonnat <cedric@bosdonnat.fr>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import hashlib
+import json
+import os
+import os.path
+from connection import GWConnection
+
+MANIFEST = 'manifest.json'
+UNDATED = 'undated'
+
+def split_events(events, events_per_shard = None):
+    '''
+    Distributes the events in shards named after the month of their UTC
+    start, like 2013-10, or in chunks of events_per_shard events sorted
+    by start if events_per_shard isn't None. Events without start are
+    put in the 'undated' shard.
+
+    Note that with fixed-size chunks, adding an event shifts all the
+    following ones to the next shards: monthly shards change less.
+
+    @param events: dictionary of the events by uid
+    @result: dictionary of the events dictionaries by shard name
+    '''
+    shards = {}
+    dated = []
+    for uid in events:
+        interval = events[uid].get_interval()
+        if interval is None:
+            shards.setdefault(UNDATED, {})[uid] = events[uid]
+        elif events_per_shard is None:
+            shards.setdefault(interval[0].strftime('%Y-%m'), {})[uid] = events[uid]
+        else:
+            dated.append((interval[0], uid))
+
+    dated.sort()
+    for (index, (start, uid)) in enumerate(dated):
+        shards.setdefault('%04d' % (index / events_per_shard), {})[uid] = events[uid]
+    return shards
+
+def read_manifest(directory):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.isfile(path):
+        return {'shards': {}}
+    fp = open(path, 'r')
+    try:
+        return json.load(fp)
+    except ValueError:
+        # Broken manifest: all the shards will be rewritten
+        return {'shards': {}}
+    finally:
+        fp.close()
+
+def write_shards(events, directory, events_per_shard = None, since = None, until = None):
+    '''
+    Writes the events in one ICS file per shard in directory, together with
+    a manifest.json file listing the shards with the SHA-1 of their content.
+    Only the shards which content changed are rewritten, and the shards
+    without events anymore are removed.
+
+    @param events: dictionary of the events by uid
+    @result: list of the names of the written shards
+    '''
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    old_manifest = read_manifest(directory)
+    manifest = {'shards': {}}
+    written = []
+
+    in_window = {}
+    for uid in events:
+        if events[uid].overlaps(since, until):
+            in_window[uid] = events[uid]
+
+    shards = split_events(in_window, events_per_shard)
+    for name in sorted(shards.keys()):
+        content = GWConnection.format_ics(shards[name], since, until)
+        filename = '%s.ics' % name
+        path = os.path.join(directory, filename)
+        sha1 = hashlib.sha1(content).hexdigest()
+
+        old = old_manifest['shards'].get(name)
+        if old is None or old.get('sha1') != sha1 or not os.path.isfile(path):
+            GWConnection.write_ics(content, path)
+            written.append(name)
+        manifest['shards'][name] = {'file': filename,
+                                    'sha1': sha1,
+                                    'size': len(content)}
+
+    # The manifest is only replaced once all its shards are written and
+    # the old shards are removed afterwards, so it never lists missing files
+    GWConnection.write_ics(json.dumps(manifest, indent = 2, sort_keys = True),
+                           os.path.join(directory, MANIFEST))
+
+    for name in old_manifest['shards']:
+        if name not in manifest['shards']:
+            path = os.path.join(directory, old_manifest['shards'][name]['file'])
+            if os.path.isfile(path):
+                os.remove(path)
+    return written
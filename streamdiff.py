@@ -0,0 +1,215 @@
+# groupwise-ics: synchronize GroupWise calendar to ICS file and back
+# Copyright (C) 2013  Cedric Bosdonnat <cedric@bosdonnat.fr>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import hashlib
+import heapq
+import marshal
+import tempfile
+from cal import LineUnwrapper, Timezone, Event, ParametrizedValue
+
+def parse_event(text, tzmap):
+    '''
+    Parses the VEVENT component in text, including its BEGIN and END lines
+    '''
+    event = Event(tzmap)
+    # The unwrapper only yields a line once it gets the next one
+    for (real_lines, line) in LineUnwrapper(text + '\n').each_line():
+        if line != 'BEGIN:VEVENT' and line != 'END:VEVENT':
+            event.parseline(real_lines, line)
+    return event
+
+def get_fingerprint(event):
+    '''
+    @result: a hash equal for events comparing equal with Event.__eq__
+    '''
+    def canonical(value):
+        if isinstance(value, ParametrizedValue):
+            return (tuple(sorted(value.params.items())), value.value)
+        return value
+
+    properties = sorted([(key, canonical(event.properties[key][0]))
+                         for key in event.properties])
+    attendees = sorted(set([canonical(attendee) for attendee in event.attendees]))
+    return hashlib.sha1(repr((properties, attendees))).hexdigest()
+
+def get_uid(event):
+    if event.gwrecordid is not None:
+        return event.gwrecordid
+    return event.uid
+
+class IcsScanner(object):
+    '''
+    Reads the events of an ICS file one at a time, remembering their position
+    in the file so that they can be loaded again later.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.tzmap = {}
+
+    def each_event(self):
+        '''
+        @result: iterator over (uid, fingerprint, offset, length) tuples
+        '''
+        fp = open(self.path, 'rb')
+        offset = 0
+        start = None
+        component = None
+        lines = []
+        for line in fp:
+            stripped = line.strip()
+            if component is None:
+                if stripped == 'BEGIN:VEVENT' or stripped == 'BEGIN:VTIMEZONE':
+                    component = stripped[len('BEGIN:'):]
+                    start = offset
+                    lines = [line]
+            else:
+                lines.append(line)
+                if stripped == 'END:%s' % component:
+                    if component == 'VTIMEZONE':
+                        self.add_timezone(lines)
+                    else:
+                        event = parse_event(''.join(lines), self.tzmap)
+                        length = offset + len(line) - start
+                        yield (get_uid(event), get_fingerprint(event), start, length)
+                    component = None
+                    lines = []
+            offset += len(line)
+        fp.close()
+
+    def add_timezone(self, lines):
+        timezone = Timezone()
+        for (real_lines, line) in LineUnwrapper(''.join(lines) + '\n').each_line():
+            if line != 'BEGIN:VTIMEZONE' and line != 'END:VTIMEZONE':
+                timezone.parseline(line)
+        self.tzmap[timezone.tzid] = timezone
+
+    def load_event(self, offset, length):
+        fp = open(self.path, 'rb')
+        fp.seek(offset)
+        text = fp.read(length)
+        fp.close()
+        return parse_event(text, self.tzmap)
+
+class EventRef(object):
+    '''
+    Event left in its ICS file until load() is called
+    '''
+    def __init__(self, scanner, offset, length):
+        self.scanner = scanner
+        self.offset = offset
+        self.length = length
+
+    def load(self):
+        return self.scanner.load_event(self.offset, self.length)
+
+class ExternalSorter(object):
+    '''
+    Sorts tuples, spilling sorted runs to temporary files whenever the
+    buffered tuples exceed the memory budget in bytes.
+    '''
+    # Rough memory cost of a (uid, fingerprint, offset, length) tuple
+    ENTRY_OVERHEAD = 200
+
+    def __init__(self, memory_budget, tmpdir = None):
+        self.memory_budget = memory_budget
+        self.tmpdir = tmpdir
+        self.buffer = []
+        self.buffer_size = 0
+        self.runs = []
+
+    def add(self, item):
+        self.buffer.append(item)
+        self.buffer_size += len(item[0] or '') + ExternalSorter.ENTRY_OVERHEAD
+        if self.buffer_size > self.memory_budget:
+            self.spill()
+
+    def spill(self):
+        self.buffer.sort()
+        run = tempfile.TemporaryFile(dir = self.tmpdir)
+        for item in self.buffer:
+            marshal.dump(item, run)
+        run.seek(0)
+        self.runs.append(run)
+        self.buffer = []
+        self.buffer_size = 0
+
+    @staticmethod
+    def read_run(run):
+        try:
+            while True:
+                yield marshal.load(run)
+        except EOFError:
+            run.close()
+
+    def sorted_items(self):
+        self.buffer.sort()
+        iterators = [ExternalSorter.read_run(run) for run in self.runs]
+        iterators.append(iter(self.buffer))
+        return heapq.merge(*iterators)
+
+def sorted_events(scanner, memory_budget, tmpdir = None):
+    '''
+    @result: iterator over the (uid, offset, fingerprint, length) tuples
+             of the scanned events sorted by uid. Like
+             Calendar.get_events_by_uid, only the last event of the file
+             is kept for each uid.
+    '''
+    sorter = ExternalSorter(memory_budget, tmpdir)
+    for (uid, fingerprint, offset, length) in scanner.each_event():
+        sorter.add((uid, offset, fingerprint, length))
+
+    previous = None
+    for item in sorter.sorted_items():
+        if previous is not None and previous[0] != item[0]:
+            yield previous
+        previous = item
+    if previous is not None:
+        yield previous
+
+def diff_files(old_path, new_path, memory_budget = 64 * 1024 * 1024, tmpdir = None):
+    '''
+    Searches for differences between two ICS files like Calendar.diff,
+    without loading the calendars in memory.
+
+    @param memory_budget: approximate number of bytes to use for each file
+                          before spilling the sorted events to tmpdir
+    @result: iterator over (kind, uid, value) tuples where kind is one of
+             'changed', 'removed', 'added' and 'unchanged'. The value of
+             changed items is a dictionary with the 'old' and 'new' events,
+             the one of added items is the new event. Removed and unchanged
+             items get an EventRef to avoid loading them.
+    '''
+    old_scanner = IcsScanner(old_path)
+    new_scanner = IcsScanner(new_path)
+    old_items = sorted_events(old_scanner, memory_budget, tmpdir)
+    new_items = sorted_events(new_scanner, memory_budget, tmpdir)
+
+    old = next(old_items, None)
+    new = next(new_items, None)
+    while old is not None or new is not None:
+        if new is None or (old is not None and old[0] < new[0]):
+            yield ('removed', old[0], EventRef(old_scanner, old[1], old[3]))
+            old = next(old_items, None)
+        elif old is None or new[0] < old[0]:
+            yield ('added', new[0], new_scanner.load_event(new[1], new[3]))
+            new = next(new_items, None)
+        else:
+            if old[2] == new[2]:
+                yield ('unchanged', old[0], EventRef(old_scanner, old[1], old[3]))
+            else:
+                yield ('changed', old[0], {'old': old_scanner.load_event(old[1], old[3]),
+                                           'new': new_scanner.load_event(new[1], new[3])})
+            old = next(old_items, None)
+            new = next(new_items, None)
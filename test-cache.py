@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+# groupwise-ics: synchronize GroupWise calendar to ICS file and back
+# Copyright (C) 2013  Cedric Bosdonnat <cedric@bosdonnat.fr>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os
+import os.path
+import shutil
+import stat
+import tempfile
+import zlib
+import cal
+from cache import EventCache
+
+def create_payload(uid):
+    return '\r\n'.join(['BEGIN:VCALENDAR',
+                        'VERSION:2.0',
+                        'BEGIN:VEVENT',
+                        'UID:%s' % uid,
+                        'DTSTAMP:20131007T194119Z',
+                        'DTSTART:20131008T130000Z',
+                        'DTEND:20131008T133000Z',
+                        'SUMMARY:summary of %s' % uid,
+                        'ORGANIZER;CN=Joe Hacker:MAILTO:joe@hacker.com',
+                        'ATTENDEE;CUTYPE=INDIVIDUAL;PARTSTAT=ACCEPTED;CN=Joe HACKER:MAILTO:',
+                        ' joe@hacker.com',
+                        'ATTENDEE;PARTSTAT=NEEDS-ACTION:MAILTO:alice@hacker.com',
+                        'END:VEVENT',
+                        'END:VCALENDAR'])
+
+class Counter(object):
+    def __init__(self, func):
+        self.func = func
+        self.calls = 0
+
+    def __call__(self, *args):
+        self.calls += 1
+        return self.func(*args)
+
+class EventCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        # Mails are the payload with some headers
+        self.extract = Counter(lambda mail: mail[mail.find('\n\n') + 2:] or None)
+        self.parse = Counter(lambda payload: cal.Calendar(payload, lazy = True).events[0])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_event_state(self):
+        event = cal.Calendar(create_payload('some-uid')).events[0]
+        loaded = cal.Event.from_state(event.get_state())
+        self.assertEqual(loaded, event)
+        self.assertEqual(loaded.to_ical(), event.to_ical())
+        self.assertEqual(loaded.organizer, event.organizer)
+
+    def test_hits(self):
+        cache = EventCache(self.tmpdir)
+        mail = 'Subject: invitation\n\n%s' % create_payload('some-uid')
+        forward = 'Subject: Fwd: invitation\n\n%s' % create_payload('some-uid')
+
+        event = cache.get_event(mail, self.extract, self.parse)
+        self.assertEqual(event.uid, 'some-uid')
+        self.assertEqual((self.extract.calls, self.parse.calls), (1, 1))
+
+        # Another run sharing the cache doesn't even extract the payload
+        event = EventCache(self.tmpdir).get_event(mail, self.extract, self.parse)
+        self.assertEqual(event.summary, 'summary of some-uid')
+        self.assertEqual((self.extract.calls, self.parse.calls), (1, 1))
+
+        # A forward with the same payload isn't parsed again
+        event = cache.get_event(forward, self.extract, self.parse)
+        self.assertEqual(len(event.attendees), 2)
+        self.assertEqual((self.extract.calls, self.parse.calls), (2, 1))
+
+        # Mails without invitation are cached too
+        self.assertEqual(cache.get_event('Subject: hello\n\n', self.extract, self.parse), None)
+        self.assertEqual(cache.get_event('Subject: hello\n\n', self.extract, self.parse), None)
+        self.assertEqual(self.extract.calls, 3)
+
+    def test_non_ascii(self):
+        cache = EventCache(self.tmpdir)
+        # Both UTF-8 and broken encodings have to survive the cache
+        for summary in ('r\xc3\xa9union', 'r\xe9union'):
+            mail = 'Subject: invitation\n\n%s' % create_payload('some-uid').replace('summary of', summary)
+            cache.get_event(mail, self.extract, self.parse)
+            event = EventCache(self.tmpdir).get_event(mail, self.extract, self.parse)
+            self.assertEqual(event.summary, '%s some-uid' % summary)
+
+    def test_invalid_entries(self):
+        cache = EventCache(self.tmpdir)
+        mail = 'Subject: invitation\n\n%s' % create_payload('some-uid')
+        cache.get_event(mail, self.extract, self.parse)
+
+        payload_key = EventCache.hash(create_payload('some-uid'))
+        for data in ('not json', '{"lines": []}', '[["line"], [["uid", 42, 1]], []]',
+                     '[["line"], [], [[{"CN": 1}, "joe"]]]', 'x' * (5 * 1024 * 1024)):
+            cache.write('events', payload_key, zlib.compress(data))
+            event = cache.get_event(mail, self.extract, self.parse)
+            self.assertEqual(event.uid, 'some-uid')
+        self.assertEqual(self.parse.calls, 6)
+
+        # Mail entries pointing outside of the cache are ignored
+        cache.write('mails', EventCache.hash(mail), '../../../../etc/passwd')
+        self.assertEqual(cache.get_event(mail, self.extract, self.parse).uid, 'some-uid')
+
+    def test_modes(self):
+        mail = 'Subject: invitation\n\n%s' % create_payload('some-uid')
+        for (shared, umask, dir_mode, file_mode) in ((False, 0, 0700, 0600),
+                                                     (True, 077, 0770, 0660)):
+            path = os.path.join(self.tmpdir, str(shared))
+            # The modes don't depend on the umask
+            umask = os.umask(umask)
+            try:
+                EventCache(path, shared = shared).get_event(mail, self.extract, self.parse)
+            finally:
+                os.umask(umask)
+            for (dirpath, dirnames, filenames) in os.walk(os.path.join(path, EventCache.VERSION)):
+                self.assertEqual(stat.S_IMODE(os.stat(dirpath).st_mode), dir_mode)
+                for filename in filenames:
+                    filename = os.path.join(dirpath, filename)
+                    self.assertEqual(stat.S_IMODE(os.stat(filename).st_mode), file_mode)
+
+    def test_eviction(self):
+        cache = EventCache(self.tmpdir, max_size = 4096)
+        for index in range(50):
+            mail = 'Subject: invitation\n\n%s' % create_payload('uid-%d' % index)
+            cache.get_event(mail, self.extract, self.parse)
+        self.assertTrue(cache.compute_size() <= 4096)
+        self.assertTrue(cache.compute_size() > 0)
+
+if __name__ == '__main__':
+    unittest.main()
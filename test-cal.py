@@ -34,6 +34,17 @@ def create_parametrized_value(params, value):
     parametrized.value = value
     return parametrized
 
+def create_calendar_data(events):
+    lines = ['BEGIN:VCALENDAR',
+             'PRODID:-//Ximian//NONSGML Evolution Calendar//EN',
+             'VERSION:2.0']
+    for event in events:
+        lines.append('BEGIN:VEVENT')
+        lines.extend(event)
+        lines.append('END:VEVENT')
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(lines)
+
 class CalendarTest(unittest.TestCase):
 
     def test_timezone_utcoffset(self):
@@ -267,5 +278,108 @@ class CalendarTest(unittest.TestCase):
         self.assertEqual(len(added), 0)
         self.assertEqual(changed.keys()[0], 'changed-event-uid')
 
+    def test_calendar_events_between(self):
+        data = create_calendar_data([['UID:short', 'DTSTAMP:20131007T194119Z',
+                                      'DTSTART:20131008T130000Z', 'DTEND:20131008T133000Z'],
+                                     ['UID:long', 'DTSTAMP:20131007T194119Z',
+                                      'DTSTART:20131001T080000Z', 'DTEND:20131010T180000Z'],
+                                     ['UID:allday', 'DTSTAMP:20131007T194119Z',
+                                      'DTSTART;VALUE=DATE:20131009'],
+                                     ['UID:undated', 'DTSTAMP:20131007T194119Z']])
+        calendar = cal.Calendar(data)
+
+        def uids(events):
+            return [event.uid for event in events]
+
+        self.assertEqual(uids(calendar.get_events_between(datetime.datetime(2013, 10, 8, 13, 15),
+                                                          datetime.datetime(2013, 10, 8, 14, 0))),
+                         ['long', 'short'])
+        self.assertEqual(uids(calendar.get_events_between(datetime.datetime(2013, 10, 9, 12, 0),
+                                                          datetime.datetime(2013, 10, 9, 13, 0))),
+                         ['long', 'allday'])
+        self.assertEqual(uids(calendar.get_events_between(datetime.datetime(2013, 10, 10, 18, 0),
+                                                          None)),
+                         [])
+        self.assertEqual(uids(calendar.get_events_between(None, None)),
+                         ['long', 'short', 'allday'])
+
+    def test_calendar_events_involving(self):
+        data = create_calendar_data([['UID:organized', 'DTSTAMP:20131007T194119Z',
+                                      'ORGANIZER;CN=Joe Hacker:MAILTO:joe@hacker.com'],
+                                     ['UID:attended', 'DTSTAMP:20131007T194119Z',
+                                      'ORGANIZER;CN=Alice:MAILTO:alice@hacker.com',
+                                      'ATTENDEE;CN=Joe HACKER:mailto:Joe@Hacker.com']])
+        calendar = cal.Calendar(data)
+
+        self.assertEqual([event.uid for event in calendar.get_events_involving('joe@hacker.com')],
+                         ['organized', 'attended'])
+        self.assertEqual([event.uid for event in calendar.get_events_involving('MAILTO:alice@hacker.com')],
+                         ['attended'])
+        self.assertEqual(calendar.get_events_involving('bob@hacker.com'), [])
+        self.assertEqual(sorted(calendar.get_events_by_uid().keys()), ['attended', 'organized'])
+
+    def test_calendar_window(self):
+        data = create_calendar_data([['UID:before', 'DTSTAMP:20131007T194119Z',
+                                      'DTSTART:20131001T130000Z', 'DTEND:20131001T133000Z'],
+                                     ['UID:recurring', 'DTSTAMP:20131007T194119Z',
+                                      'DTSTART:20131001T130000Z', 'DTEND:20131001T133000Z',
+                                      'RRULE:FREQ=WEEKLY'],
+                                     ['UID:inside', 'DTSTAMP:20131007T194119Z',
+                                      'DTSTART:20131008T130000Z', 'DTEND:20131008T133000Z'],
+                                     ['UID:after', 'DTSTAMP:20131007T194119Z',
+                                      'DTSTART:20131020T130000Z', 'DTEND:20131020T133000Z',
+                                      'SUMMARY:never parsed']])
+        calendar = cal.Calendar(data, since = datetime.datetime(2013, 10, 5),
+                                until = datetime.datetime(2013, 10, 15))
+        self.assertEqual([event.uid for event in calendar.events], ['recurring', 'inside'])
+
+    def test_lazy_event(self):
+        data = create_calendar_data([['UID:lazy-event-uid',
+                                      'DTSTAMP:20131007T194119Z',
+                                      'DTSTART:20131008T130000Z',
+                                      'DTEND:20131008T133000Z',
+                                      'TRANSP:OPAQUE',
+                                      'SUMMARY:test summary',
+                                      'SUMMARY:overridden summary',
+                                      'ORGANIZER;CN=Joe Hacker:MAILTO:joe@hacker.com',
+                                      'ATTENDEE;CUTYPE=INDIVIDUAL;ROLE=REQ-PARTICIPANT;PARTSTAT=ACCEPTED;',
+                                      ' RSVP=TRUE;CN=Joe HACKER;LANGUAGE=en:MAILTO:',
+                                      ' joe@hacker.com',
+                                      'ATTENDEE;CUTYPE=INDIVIDUAL;ROLE=REQ-PARTICIPANT;PARTSTAT=NEEDS-ACTION;',
+                                      ' RSVP=TRUE;LANGUAGE=en:MAILTO:alice@hacker.com']])
+        eager = cal.Calendar(data).events[0]
+        lazy = cal.Calendar(data, lazy = True).events[0]
+
+        self.assertEqual(lazy.uid, 'lazy-event-uid')
+        self.assertEqual(lazy.dtstamp, '20131007T194119Z')
+        self.assertTrue('dtstart' in lazy.pending)
+        self.assertEqual(len(lazy.pending_attendees), 2)
+
+        self.assertEqual(lazy.summary, 'overridden summary')
+        self.assertEqual(lazy.to_ical(), eager.to_ical())
+        self.assertEqual(lazy, eager)
+        self.assertEqual(len(lazy.pending), 0)
+
+    def test_lazy_uid_lookup(self):
+        data = create_calendar_data([['UID:lazy-event-uid',
+                                      'DTSTAMP:20131007T194119Z',
+                                      'DTSTART:20131008T130000Z',
+                                      'DTEND:20131008T133000Z',
+                                      'SUMMARY:test summary',
+                                      'ATTENDEE;CN=Joe Hacker:MAILTO:joe@hacker.com']])
+        calendar = cal.Calendar(data, lazy = True)
+        lazy = calendar.events[0]
+
+        # Looking events up by uid doesn't build the other indexes
+        self.assertEqual(calendar.get_events_by_uid(), {'lazy-event-uid': lazy})
+        self.assertEqual(sorted(lazy.pending.keys()), ['dtend', 'dtstamp', 'dtstart', 'summary'])
+        self.assertEqual(len(lazy.pending_attendees), 1)
+
+        self.assertEqual(calendar.get_events_between(datetime.datetime(2013, 10, 8),
+                                                     datetime.datetime(2013, 10, 9)), [lazy])
+        self.assertEqual(len(lazy.pending_attendees), 1)
+        self.assertEqual(calendar.get_events_involving('joe@hacker.com'), [lazy])
+        self.assertEqual(len(lazy.pending_attendees), 0)
+
 if __name__ == '__main__':
     unittest.main()
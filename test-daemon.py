@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+
+# groupwise-ics: synchronize GroupWise calendar to ICS file and back
+# Copyright (C) 2013  Cedric Bosdonnat <cedric@bosdonnat.fr>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import SocketServer
+import select
+import socket
+import shutil
+import tempfile
+import threading
+import time
+import datetime
+import imaplib
+import os.path
+import cal
+import daemon
+from connection import GWConnection
+from daemon import SyncDaemon
+
+def create_invitation(uid, dtstamp, dtstart = '20131008T130000Z', dtend = '20131008T133000Z'):
+    ical = '\r\n'.join(['BEGIN:VCALENDAR',
+                        'VERSION:2.0',
+                        'METHOD:REQUEST',
+                        'BEGIN:VEVENT',
+                        'UID:%s' % uid,
+                        'DTSTAMP:%s' % dtstamp,
+                        'DTSTART:%s' % dtstart,
+                        'DTEND:%s' % dtend,
+                        'SUMMARY:summary of %s' % uid,
+                        'END:VEVENT',
+                        'END:VCALENDAR',
+                        ''])
+    return '\r\n'.join(['From: joe@hacker.com',
+                        'Subject: %s' % uid,
+                        'MIME-Version: 1.0',
+                        'Content-Type: multipart/alternative; boundary="BOUNDARY"',
+                        '',
+                        '--BOUNDARY',
+                        'Content-Type: text/plain',
+                        '',
+                        'You are invited',
+                        '--BOUNDARY',
+                        'Content-Type: text/calendar; method=REQUEST',
+                        '',
+                        ical,
+                        '--BOUNDARY--',
+                        ''])
+
+class FakeImapHandler(SocketServer.StreamRequestHandler):
+    '''
+    Just enough of IMAP4rev1 with IDLE for GWConnection
+    '''
+    def send(self, line):
+        self.wfile.write('%s\r\n' % line)
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+        server.handlers.append(self)
+        self.reported = 0
+        self.send('* OK fake IMAP server ready')
+        while True:
+            line = self.rfile.readline()
+            if line == '':
+                return
+            words = line.split()
+            (tag, command) = (words[0], words[1].upper())
+
+            if command == 'CAPABILITY':
+                self.send('* CAPABILITY %s' % ' '.join(server.capabilities))
+            elif command == 'SELECT':
+                if server.select_failures > 0:
+                    server.select_failures -= 1
+                    self.send('%s NO mailbox unavailable' % tag)
+                    continue
+                self.reported = len(server.mails)
+                self.send('* %d EXISTS' % self.reported)
+            elif command == 'SEARCH':
+                ids = [str(mail_id + 1) for mail_id in range(len(server.mails))]
+                self.send('* SEARCH %s' % ' '.join(ids))
+            elif command == 'FETCH':
+                mail_id = int(words[2])
+                mail = server.mails[mail_id - 1]
+                self.wfile.write('* %d FETCH (RFC822 {%d}\r\n%s)\r\n' % (mail_id, len(mail), mail))
+            elif command == 'IDLE':
+                if not self.idle():
+                    return
+            elif command == 'LOGOUT':
+                self.send('* BYE')
+                self.send('%s OK LOGOUT completed' % tag)
+                return
+            # Like real servers, tell about new mails in any response
+            self.report_new_mails()
+            self.send('%s OK %s completed' % (tag, command))
+
+    def report_new_mails(self):
+        if len(self.server.mails) != self.reported:
+            self.reported = len(self.server.mails)
+            self.send('* %d EXISTS' % self.reported)
+
+    def idle(self):
+        # Mails arriving while starting IDLE are reported in the same
+        # segment than the continuation
+        self.server.mails.extend(self.server.idle_mails)
+        self.server.idle_mails = []
+        lines = ['+ idling']
+        if len(self.server.mails) != self.reported:
+            self.reported = len(self.server.mails)
+            lines.append('* %d EXISTS' % self.reported)
+        self.wfile.write(''.join(['%s\r\n' % line for line in lines]))
+        self.wfile.flush()
+        while True:
+            self.report_new_mails()
+            if len(select.select([self.rfile], [], [], 0.02)[0]) > 0:
+                return self.rfile.readline() != ''
+
+class FakeImapServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, capabilities):
+        SocketServer.TCPServer.__init__(self, ('127.0.0.1', 0), FakeImapHandler)
+        self.capabilities = capabilities
+        self.mails = []
+        self.idle_mails = []
+        self.handlers = []
+        # Number of SELECT commands to answer with NO
+        self.select_failures = 0
+
+    def handle_error(self, request, client_address):
+        # Dropped connections are expected
+        pass
+
+    def drop_connections(self):
+        for handler in self.handlers:
+            try:
+                handler.request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        self.handlers = []
+
+class ConnectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.server = FakeImapServer(['IMAP4rev1', 'IDLE'])
+        threading.Thread(target = self.server.serve_forever).start()
+        self.cnx = GWConnection('127.0.0.1', self.server.server_address[1], use_ssl = False)
+
+    def tearDown(self):
+        self.server.drop_connections()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_moved_out_of_window(self):
+        # The newer invitation moves the event out of the window
+        self.server.mails.append(create_invitation('moved-uid', '20131001T100000Z',
+                                                   '20131010T130000Z', '20131010T133000Z'))
+        self.server.mails.append(create_invitation('moved-uid', '20131005T100000Z',
+                                                   '20131120T130000Z', '20131120T133000Z'))
+        self.cnx.connect('joe', 'secret', 'Calendar')
+        path = os.path.join(self.tmpdir, 'calendar.ics')
+        events = self.cnx.dump(path, datetime.datetime(2013, 10, 1),
+                               datetime.datetime(2013, 11, 1))
+        self.assertEqual(events['moved-uid'].dtstart, ':20131120T130000Z')
+        self.assertFalse('moved-uid' in open(path).read())
+
+    def test_idle_buffered_notification(self):
+        self.server.mails.append(create_invitation('first-uid', '20131007T194119Z'))
+        self.cnx.connect('joe', 'secret', 'Calendar')
+        # Forget the EXISTS response of SELECT
+        self.cnx.get_untagged_changes()
+        self.server.idle_mails.append(create_invitation('second-uid', '20131007T194119Z'))
+
+        start = time.time()
+        self.assertEqual(self.cnx.wait_for_changes(5), [(2, 'EXISTS')])
+        self.assertTrue(time.time() - start < 2)
+
+    def test_select_failure(self):
+        self.server.select_failures = 1
+        self.assertRaises(imaplib.IMAP4.error, self.cnx.connect, 'joe', 'secret', 'Calendar')
+
+class SyncDaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'calendar.ics')
+
+    def tearDown(self):
+        self.daemon.stop()
+        self.thread.join()
+        self.server.drop_connections()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def start(self, capabilities):
+        self.server = FakeImapServer(capabilities)
+        self.server.mails.append(create_invitation('first-uid', '20131007T194119Z'))
+        threading.Thread(target = self.server.serve_forever).start()
+
+        cnx = GWConnection('127.0.0.1', self.server.server_address[1], use_ssl = False)
+        cnx.connect('joe', 'secret', 'Calendar')
+        self.daemon = SyncDaemon(cnx, self.path, idle_timeout = 0.1,
+                                 min_backoff = 0.05, max_backoff = 0.2)
+        self.thread = threading.Thread(target = self.daemon.run)
+        self.thread.start()
+
+    def wait_for(self, text, writes = None):
+        for attempt in range(100):
+            if os.path.isfile(self.path) and text in open(self.path).read() and \
+                    (writes is None or self.daemon.writes >= writes):
+                return
+            time.sleep(0.05)
+        self.fail('%s never appeared in the calendar' % text)
+
+    def test_idle(self):
+        self.start(['IMAP4rev1', 'IDLE'])
+        self.wait_for('UID:first-uid')
+
+        self.server.mails.append(create_invitation('second-uid', '20131007T194119Z'))
+        self.wait_for('UID:second-uid', writes = 2)
+        self.assertEqual(self.daemon.count, 2)
+
+        # A resent invitation doesn't change the calendar
+        self.server.mails.append(create_invitation('second-uid', '20131007T194119Z'))
+        for attempt in range(100):
+            if self.daemon.count == 3:
+                break
+            time.sleep(0.05)
+        self.assertEqual(self.daemon.count, 3)
+        self.assertEqual(self.daemon.writes, 2)
+
+    def test_noop_polling(self):
+        self.start(['IMAP4rev1'])
+        self.wait_for('UID:first-uid')
+
+        self.server.mails.append(create_invitation('second-uid', '20131007T194119Z'))
+        self.wait_for('UID:second-uid')
+
+    def test_reconnect(self):
+        self.start(['IMAP4rev1', 'IDLE'])
+        self.wait_for('UID:first-uid')
+
+        self.server.drop_connections()
+        self.server.mails.append(create_invitation('second-uid', '20131007T194119Z'))
+        self.wait_for('UID:second-uid')
+
+    def test_reconnect_select_failure(self):
+        self.start(['IMAP4rev1', 'IDLE'])
+        self.wait_for('UID:first-uid')
+
+        # The mailbox isn't available right after the connection drops
+        self.server.select_failures = 1
+        self.server.drop_connections()
+        self.server.mails.append(create_invitation('second-uid', '20131007T194119Z'))
+        self.wait_for('UID:second-uid')
+        self.assertEqual(self.server.select_failures, 0)
+
+class WindowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.parse_date = daemon.parse_date
+
+    def tearDown(self):
+        daemon.parse_date = self.parse_date
+        shutil.rmtree(self.tmpdir)
+
+    def test_relative_window(self):
+        # Relative dates are evaluated at each write: make the days pass
+        today = [datetime.datetime(2013, 10, 1)]
+        def parse_date(value):
+            return today[0] + datetime.timedelta(days = int(value[:-1]))
+        daemon.parse_date = parse_date
+
+        ical = '\r\n'.join(['BEGIN:VCALENDAR',
+                             'BEGIN:VEVENT',
+                             'UID:october-uid',
+                             'DTSTART:20131008T130000Z',
+                             'DTEND:20131008T133000Z',
+                             'END:VEVENT',
+                             'BEGIN:VEVENT',
+                             'UID:november-uid',
+                             'DTSTART:20131108T130000Z',
+                             'DTEND:20131108T133000Z',
+                             'END:VEVENT',
+                             'END:VCALENDAR',
+                             ''])
+        path = os.path.join(self.tmpdir, 'calendar.ics')
+        sync = SyncDaemon(None, path, since = '+0d', until = '+30d')
+        sync.events = cal.Calendar(ical).get_events_by_uid()
+
+        sync.write()
+        content = open(path).read()
+        self.assertTrue('october-uid' in content)
+        self.assertFalse('november-uid' in content)
+
+        today[0] = datetime.datetime(2013, 11, 1)
+        sync.write()
+        content = open(path).read()
+        self.assertFalse('october-uid' in content)
+        self.assertTrue('november-uid' in content)
+
+if __name__ == '__main__':
+    unittest.main()
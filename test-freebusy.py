@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+# groupwise-ics: synchronize GroupWise calendar to ICS file and back
+# Copyright (C) 2013  Cedric Bosdonnat <cedric@bosdonnat.fr>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import datetime
+import cal
+import freebusy
+
+def create_events(events):
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0']
+    for (uid, start, end, extra) in events:
+        lines.extend(['BEGIN:VEVENT',
+                      'UID:%s' % uid,
+                      'DTSTAMP:20131007T194119Z',
+                      'DTSTART:%s' % start,
+                      'DTEND:%s' % end] + extra + ['END:VEVENT'])
+    lines.append('END:VCALENDAR')
+    return cal.Calendar('\r\n'.join(lines)).get_events_by_uid()
+
+def dt(value):
+    return datetime.datetime.strptime(value, '%Y%m%dT%H%M%SZ')
+
+class FreeBusyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.events = create_events([
+            ('a', '20131008T090000Z', '20131008T100000Z', []),
+            ('b', '20131008T093000Z', '20131008T110000Z', ['STATUS:CONFIRMED']),
+            ('c', '20131008T110000Z', '20131008T113000Z', ['TRANSP:OPAQUE']),
+            ('d', '20131008T140000Z', '20131008T150000Z', ['STATUS:TENTATIVE']),
+            ('e', '20131008T160000Z', '20131008T170000Z', ['STATUS:CANCELLED']),
+            ('f', '20131008T180000Z', '20131008T190000Z', ['TRANSP:TRANSPARENT'])])
+
+    def test_periods(self):
+        busy = freebusy.FreeBusy()
+        busy.update(self.events, self.events.keys())
+        periods = busy.get_all_periods()
+        self.assertEqual(periods[freebusy.BUSY],
+                         [(dt('20131008T090000Z'), dt('20131008T113000Z'))])
+        self.assertEqual(periods[freebusy.BUSY_TENTATIVE],
+                         [(dt('20131008T140000Z'), dt('20131008T150000Z'))])
+
+        periods = busy.get_all_periods(dt('20131008T100000Z'), dt('20131008T143000Z'))
+        self.assertEqual(periods[freebusy.BUSY],
+                         [(dt('20131008T100000Z'), dt('20131008T113000Z'))])
+        self.assertEqual(periods[freebusy.BUSY_TENTATIVE],
+                         [(dt('20131008T140000Z'), dt('20131008T143000Z'))])
+
+    def test_incremental_update(self):
+        busy = freebusy.FreeBusy()
+        busy.update(self.events, self.events.keys())
+
+        changes = create_events([('b', '20131008T120000Z', '20131008T123000Z', []),
+                                 ('e', '20131008T160000Z', '20131008T170000Z', []),
+                                 ('g', '20131008T123000Z', '20131008T130000Z', [])])
+        self.events.update(changes)
+        del self.events['c']
+        busy.update(self.events, changes.keys() + ['c'])
+
+        rebuilt = freebusy.FreeBusy()
+        rebuilt.update(self.events, self.events.keys())
+        self.assertEqual(busy.get_all_periods(), rebuilt.get_all_periods())
+        self.assertEqual(busy.get_all_periods()[freebusy.BUSY],
+                         [(dt('20131008T090000Z'), dt('20131008T100000Z')),
+                          (dt('20131008T120000Z'), dt('20131008T130000Z')),
+                          (dt('20131008T160000Z'), dt('20131008T170000Z'))])
+
+    def test_ical(self):
+        events = create_events([('uid-%d' % hour, '201310%02dT%02d0000Z' % (hour / 24 + 1, hour % 24),
+                                 '201310%02dT%02d3000Z' % (hour / 24 + 1, hour % 24), [])
+                                for hour in range(48)])
+        busy = freebusy.FreeBusy()
+        busy.update(events, events.keys())
+        ical = busy.to_ical()
+
+        lines = ical.split('\r\n')
+        self.assertTrue('DTSTART:20131001T000000Z' in lines)
+        self.assertTrue('DTEND:20131002T233000Z' in lines)
+        for line in lines:
+            self.assertTrue(len(line) <= 75)
+        unfolded = ical.replace('\r\n ', '')
+        self.assertEqual(unfolded.count('Z/2013'), 48)
+        self.assertTrue('FREEBUSY;FBTYPE=BUSY:20131001T000000Z/20131001T003000Z,' in unfolded)
+
+    def test_binary(self):
+        busy = freebusy.FreeBusy()
+        busy.update(self.events, self.events.keys())
+        self.assertEqual(freebusy.read_binary(busy.to_binary()),
+                         [(dt('20131008T090000Z'), dt('20131008T113000Z'), freebusy.BUSY),
+                          (dt('20131008T140000Z'), dt('20131008T150000Z'), freebusy.BUSY_TENTATIVE)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+# groupwise-ics: synchronize GroupWise calendar to ICS file and back
+# Copyright (C) 2013  Cedric Bosdonnat <cedric@bosdonnat.fr>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import email
+import mime
+from connection import GWConnection
+
+ICAL = '\r\n'.join(['BEGIN:VCALENDAR',
+                    'BEGIN:VEVENT',
+                    'UID:some-uid',
+                    'SUMMARY:R\xc3\xa9union',
+                    'END:VEVENT',
+                    'END:VCALENDAR'])
+
+class MimeTest(unittest.TestCase):
+
+    def test_single_part(self):
+        raw = '\r\n'.join(['Subject: test',
+                           'Content-Type: text/calendar; method=REQUEST',
+                           '',
+                           ICAL])
+        self.assertEqual(mime.find_calendar_part(raw), ICAL)
+
+    def test_nested_base64(self):
+        raw = '\n'.join(['Subject: test',
+                         'Content-Type: multipart/mixed;',
+                         '  boundary="outer"',
+                         '',
+                         'preamble',
+                         '--outer',
+                         'Content-Type: multipart/alternative; boundary=inner',
+                         '',
+                         '--inner',
+                         'Content-Type: text/plain',
+                         '',
+                         'BEGIN:VCALENDAR in plain text',
+                         '--inner',
+                         'CONTENT-TYPE: Text/Calendar',
+                         'Content-Transfer-Encoding: BASE64',
+                         '',
+                         ICAL.encode('base64').strip(),
+                         '--inner--',
+                         '--outer',
+                         'Content-Type: text/calendar',
+                         '',
+                         'second calendar',
+                         '--outer--',
+                         ''])
+        self.assertEqual(mime.find_calendar_part(raw), ICAL)
+
+    def test_quoted_printable(self):
+        raw = '\r\n'.join(['Content-Type: multipart/alternative; boundary="b"',
+                           '',
+                           '--b',
+                           'Content-Type: text/calendar',
+                           'Content-Transfer-Encoding: quoted-printable',
+                           '',
+                           'BEGIN:VCALENDAR',
+                           'SUMMARY:R=C3=A9union tr=',
+                           'op longue',
+                           'END:VCALENDAR',
+                           '--b--'])
+        self.assertEqual(mime.find_calendar_part(raw),
+                         'BEGIN:VCALENDAR\r\nSUMMARY:R\xc3\xa9union trop longue\r\nEND:VCALENDAR')
+
+    def test_no_calendar(self):
+        raw = '\r\n'.join(['Content-Type: multipart/alternative; boundary="b"',
+                           '',
+                           '--b',
+                           'Content-Type: text/plain',
+                           '',
+                           'hello',
+                           '--b--'])
+        self.assertEqual(mime.find_calendar_part(raw), None)
+        self.assertEqual(mime.find_calendar_part('Subject: hello\r\n\r\nhello'), None)
+
+    def test_forwarded(self):
+        invitation = '\r\n'.join(['From: joe@hacker.com',
+                                   'Subject: meeting',
+                                   'Content-Type: multipart/alternative; boundary="inner"',
+                                   '',
+                                   '--inner',
+                                   'Content-Type: text/plain',
+                                   '',
+                                   'You are invited',
+                                   '--inner',
+                                   'Content-Type: text/calendar',
+                                   'Content-Transfer-Encoding: base64',
+                                   '',
+                                   ICAL.encode('base64').strip(),
+                                   '--inner--',
+                                   ''])
+        raw = '\r\n'.join(['Subject: Fwd: meeting',
+                            'Content-Type: multipart/mixed; boundary="outer"',
+                            '',
+                            '--outer',
+                            'Content-Type: text/plain',
+                            '',
+                            'See the attached invitation',
+                            '--outer',
+                            'Content-Type: message/rfc822',
+                            '',
+                            invitation,
+                            '--outer--',
+                            ''])
+        self.assertEqual(mime.find_calendar_part(raw), ICAL)
+        self.assertEqual(GWConnection.get_ical_from_multipart(email.message_from_string(raw)), ICAL)
+
+    def test_malformed_fallback(self):
+        raw = '\r\n'.join(['Content-Type: multipart/alternative; boundary="b"',
+                           '',
+                           '--b',
+                           'Content-Type: text/plain',
+                           '',
+                           'hello',
+                           '--b',
+                           'Content-Type: text/calendar',
+                           '',
+                           ICAL])
+        self.assertRaises(mime.MimeError, mime.find_calendar_part, raw)
+        self.assertEqual(GWConnection.get_ical_from_mail(raw), ICAL)
+
+if __name__ == '__main__':
+    unittest.main()
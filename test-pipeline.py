@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+
+# groupwise-ics: synchronize GroupWise calendar to ICS file and back
+# Copyright (C) 2013  Cedric Bosdonnat <cedric@bosdonnat.fr>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import BaseHTTPServer
+import SocketServer
+import os
+import os.path
+import re
+import shutil
+import tempfile
+import threading
+import time
+import cal
+from connection import GwSoapClient, ItemIds
+from pipeline import PushPipeline, CalendarPusher
+
+def create_event(uid, summary, gwrecordid = None):
+    lines = ['BEGIN:VEVENT',
+             'UID:%s' % uid,
+             'DTSTAMP:20131007T194119Z',
+             'DTSTART:20131008T130000Z',
+             'DTEND:20131008T133000Z',
+             'SUMMARY:%s' % summary]
+    if gwrecordid is not None:
+        lines.append('X-GWRECORDID:%s' % gwrecordid)
+    lines.append('END:VEVENT')
+    return lines
+
+def create_calendar(events):
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0']
+    for event in events:
+        lines.extend(event)
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(lines) + '\r\n'
+
+def parse_event(uid, summary):
+    return cal.Calendar(create_calendar([create_event(uid, summary)])).events[0]
+
+class StubSoapHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Just enough of the GroupWise SOAP API for GwSoapClient.push_event
+    '''
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        with server.lock:
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        time.sleep(server.latency)
+        try:
+            response = server.answer(self.headers['SOAPAction'], body)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+        if response is None:
+            self.send_response(500)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        response = '<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" ' \
+                   'xmlns:gwm="http://schemas.novell.com/2005/01/GroupWise/methods" ' \
+                   'xmlns:gwt="http://schemas.novell.com/2005/01/GroupWise/types">' \
+                   '<SOAP-ENV:Body>%s</SOAP-ENV:Body></SOAP-ENV:Envelope>' % response
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml;charset=utf-8')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+class StubSoapServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    STATUS = '<gwm:status><gwt:code>0</gwt:code></gwm:status>'
+
+    def __init__(self, latency):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StubSoapHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        # Number of requests to fail for each uid or item id
+        self.failures = {}
+        # (request, uid or item id) tuples of the item requests
+        self.log = []
+
+    def answer(self, action, body):
+        if action == 'loginRequest':
+            return '<gwm:loginResponse><gwm:session>session</gwm:session>%s' \
+                   '</gwm:loginResponse>' % StubSoapServer.STATUS
+        if action == 'getFolderListRequest':
+            return '<gwm:getFolderListResponse><gwm:folders><gwt:folder>' \
+                   '<gwt:id>calendar-folder</gwt:id><gwt:name>Calendar</gwt:name>' \
+                   '</gwt:folder></gwm:folders>%s</gwm:getFolderListResponse>' % StubSoapServer.STATUS
+
+        if action == 'createItemRequest':
+            key = re.search('<ns1:iCalId>(.*?)</ns1:iCalId>', body).group(1)
+        else:
+            key = re.search('<ns2:id>(.*?)</ns2:id>', body).group(1)
+        with self.lock:
+            if self.failures.get(key, 0) > 0:
+                self.failures[key] -= 1
+                return None
+            self.log.append((action, key))
+
+        if action == 'createItemRequest':
+            return '<gwm:createItemResponse><gwm:id>item-%s</gwm:id>%s' \
+                   '</gwm:createItemResponse>' % (key, StubSoapServer.STATUS)
+        return '<gwm:%s>%s</gwm:%s>' % (action.replace('Request', 'Response'),
+                                        StubSoapServer.STATUS,
+                                        action.replace('Request', 'Response'))
+
+class PipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.server = StubSoapServer(0.05)
+        self.thread = threading.Thread(target = self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.pipeline = None
+
+    def tearDown(self):
+        if self.pipeline is not None:
+            self.pipeline.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def create_client(self, ids = None):
+        return GwSoapClient('127.0.0.1', self.server.server_address[1], 'joe', 'secret',
+                            use_ssl = False, ids = ids)
+
+    def start_pipeline(self, workers = 4, retries = 3):
+        def create_push():
+            return self.create_client().push_event
+        self.pipeline = PushPipeline(create_push, workers = workers, retries = retries,
+                                     min_backoff = 0.01, max_backoff = 0.05)
+        self.pipeline.start()
+        return self.pipeline
+
+    def wait_for(self, condition, timeout = 10):
+        end = time.time() + timeout
+        while not condition():
+            self.assertTrue(time.time() < end, 'Timed out')
+            time.sleep(0.01)
+
+    def wait_finished(self, pipeline):
+        self.wait_for(lambda: pipeline.get_metrics()['batches'] == 0)
+
+    def test_concurrency(self):
+        pipeline = self.start_pipeline()
+        changes = [('added', 'uid-%d' % index, parse_event('uid-%d' % index, 'added'))
+                   for index in range(20)]
+        batch = pipeline.submit(changes)
+
+        metrics = pipeline.get_metrics()
+        self.assertEqual(metrics['batches'], 1)
+        self.assertTrue(metrics['queued'] + metrics['in_flight'] > 0)
+        self.wait_for(lambda: pipeline.get_metrics()['lag'] > 0.05)
+
+        self.wait_finished(pipeline)
+        self.assertEqual(pipeline.pop_finished(), [batch])
+        self.assertFalse(batch.failed)
+        self.assertEqual(sorted([key for (action, key) in self.server.log]),
+                         sorted([uid for (kind, uid, value) in changes]))
+        self.assertTrue(self.server.max_active > 1)
+        self.assertTrue(self.server.max_active <= 4)
+
+        metrics = pipeline.get_metrics()
+        self.assertEqual((metrics['queued'], metrics['in_flight'], metrics['lag']), (0, 0, 0))
+        self.assertEqual((metrics['pushed'], metrics['failed'], metrics['retried']), (20, 0, 0))
+
+    def test_uid_ordering(self):
+        pipeline = self.start_pipeline()
+        pipeline.submit([('added', 'uid', parse_event('uid', 'first'))] +
+                        [('added', 'other-%d' % index, parse_event('other-%d' % index, 'other'))
+                         for index in range(10)])
+        pipeline.submit([('changed', 'uid', {'old': parse_event('uid', 'first'),
+                                             'new': parse_event('uid', 'second')})])
+        pipeline.submit([('removed', 'uid', parse_event('uid', 'second'))])
+        self.wait_finished(pipeline)
+
+        self.assertEqual([item for item in self.server.log if item[1] in ('uid', 'item-uid')],
+                         [('createItemRequest', 'uid'),
+                          ('modifyItemRequest', 'item-uid'),
+                          ('removeItemRequest', 'item-uid')])
+        self.assertEqual(len(pipeline.pop_finished()), 3)
+
+    def test_retry(self):
+        pipeline = self.start_pipeline(retries = 3)
+        self.server.failures = {'uid': 2}
+        batch = pipeline.submit([('added', 'uid', parse_event('uid', 'added'))])
+        self.wait_finished(pipeline)
+
+        self.assertFalse(batch.failed)
+        self.assertEqual(self.server.log, [('createItemRequest', 'uid')])
+        metrics = pipeline.get_metrics()
+        self.assertEqual((metrics['pushed'], metrics['failed'], metrics['retried']), (1, 0, 2))
+
+    def test_give_up(self):
+        pipeline = self.start_pipeline(retries = 1)
+        self.server.failures = {'uid': 5}
+        batch = pipeline.submit([('added', 'uid', parse_event('uid', 'added')),
+                                 ('added', 'other', parse_event('other', 'added'))])
+        self.wait_finished(pipeline)
+
+        self.assertTrue(batch.failed)
+        self.assertEqual(self.server.log, [('createItemRequest', 'other')])
+        metrics = pipeline.get_metrics()
+        self.assertEqual((metrics['pushed'], metrics['failed'], metrics['retried']), (1, 1, 1))
+
+    def test_finish_order(self):
+        # A batch finished before an older one has to wait for it
+        release = threading.Event()
+        def create_push():
+            def push(kind, uid, value):
+                if uid == 'slow':
+                    release.wait()
+            return push
+        self.pipeline = PushPipeline(create_push, workers = 2)
+        self.pipeline.start()
+
+        # Find an uid not handled by the worker of 'slow'
+        fast = [uid for uid in ('a', 'b', 'c', 'd')
+                if hash(uid) % 2 != hash('slow') % 2][0]
+        first = self.pipeline.submit([('added', 'slow', None)])
+        second = self.pipeline.submit([('added', fast, None)])
+        self.wait_for(second.is_finished)
+        self.assertEqual(self.pipeline.pop_finished(), [])
+        self.assertEqual(self.pipeline.get_metrics()['batches'], 1)
+
+        release.set()
+        self.wait_for(first.is_finished)
+        self.assertEqual(self.pipeline.pop_finished(), [first, second])
+
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        fp = open(path, 'wb')
+        fp.write(content)
+        fp.close()
+        return path
+
+    def read(self, path):
+        fp = open(path, 'rb')
+        content = fp.read()
+        fp.close()
+        return content
+
+    def test_roll_forward(self):
+        old_data = create_calendar([create_event('kept', 'kept'),
+                                    create_event('removed', 'removed', 'gw-removed')])
+        new_data = create_calendar([create_event('kept', 'kept'),
+                                    create_event('added', 'added')])
+        old_path = self.write('cached.ics', old_data)
+        new_path = self.write('calendar.ics', new_data)
+
+        pusher = CalendarPusher(old_path, self.start_pipeline())
+        self.server.failures = {'gw-removed': 1}
+        pusher.calendar_changed(new_path)
+        # Pushing takes some time: the cached calendar isn't replaced yet
+        self.assertEqual(self.read(old_path), old_data)
+
+        self.wait_finished(self.pipeline)
+        pusher.roll_forward()
+        self.assertEqual(self.read(old_path), new_data)
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['cached.ics', 'calendar.ics'])
+        self.assertEqual(sorted(self.server.log), [('createItemRequest', 'added'),
+                                                   ('removeItemRequest', 'gw-removed')])
+        self.assertEqual(self.pipeline.get_metrics()['retried'], 1)
+
+    def test_roll_forward_failure(self):
+        old_data = create_calendar([create_event('kept', 'kept')])
+        new_data = create_calendar([create_event('kept', 'kept'),
+                                    create_event('added', 'added')])
+        newer_data = create_calendar([create_event('kept', 'kept'),
+                                      create_event('added', 'added'),
+                                      create_event('later', 'later')])
+        old_path = self.write('cached.ics', old_data)
+        new_path = self.write('calendar.ics', new_data)
+
+        pusher = CalendarPusher(old_path, self.start_pipeline(retries = 0))
+        self.server.failures = {'added': 1}
+        pusher.calendar_changed(new_path)
+        self.wait_finished(self.pipeline)
+        pusher.roll_forward()
+        self.assertEqual(self.read(old_path), old_data)
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['cached.ics', 'calendar.ics'])
+
+        # The next change is diffed against the cached calendar again
+        self.write('calendar.ics', newer_data)
+        pusher.calendar_changed(new_path)
+        self.wait_finished(self.pipeline)
+        pusher.roll_forward()
+        self.assertEqual(self.read(old_path), newer_data)
+        self.assertEqual(sorted(self.server.log), [('createItemRequest', 'added'),
+                                                   ('createItemRequest', 'later')])
+
+    def test_partial_failure(self):
+        # The changes pushed in a failed batch aren't sent again
+        old_data = create_calendar([create_event('kept', 'kept'),
+                                    create_event('removed', 'removed', 'gw-removed')])
+        new_data = create_calendar([create_event('kept', 'kept'),
+                                    create_event('ok', 'ok'),
+                                    create_event('bad', 'bad')])
+        newer_data = create_calendar([create_event('kept', 'kept'),
+                                      create_event('ok', 'ok'),
+                                      create_event('bad', 'bad'),
+                                      create_event('later', 'later')])
+        old_path = self.write('cached.ics', old_data)
+        new_path = self.write('calendar.ics', new_data)
+
+        pusher = CalendarPusher(old_path, self.start_pipeline(retries = 0))
+        self.server.failures = {'bad': 1}
+        pusher.calendar_changed(new_path)
+        self.wait_finished(self.pipeline)
+        pusher.roll_forward()
+        self.assertEqual(self.read(old_path), old_data)
+
+        self.write('calendar.ics', newer_data)
+        pusher.calendar_changed(new_path)
+        self.wait_finished(self.pipeline)
+        pusher.roll_forward()
+        self.assertEqual(self.read(old_path), newer_data)
+        self.assertEqual(sorted(self.server.log), [('createItemRequest', 'bad'),
+                                                   ('createItemRequest', 'later'),
+                                                   ('createItemRequest', 'ok'),
+                                                   ('removeItemRequest', 'gw-removed')])
+        metrics = self.pipeline.get_metrics()
+        self.assertEqual((metrics['pushed'], metrics['failed']), (4, 1))
+
+    def test_item_ids(self):
+        path = os.path.join(self.tmpdir, 'cached.ics.ids')
+        ids = ItemIds(path)
+        client = self.create_client(ids)
+        client.push_event('added', 'uid', parse_event('uid', 'first'))
+        # Pushing the same change again modifies the created item
+        client.push_event('added', 'uid', parse_event('uid', 'first'))
+        ids.close()
+
+        # The ids are kept after a restart
+        ids = ItemIds(path)
+        client = self.create_client(ids)
+        client.push_event('added', 'uid', parse_event('uid', 'second'))
+        client.push_event('removed', 'uid', parse_event('uid', 'second'))
+        ids.close()
+        self.assertEqual(self.server.log, [('createItemRequest', 'uid'),
+                                           ('modifyItemRequest', 'item-uid'),
+                                           ('modifyItemRequest', 'item-uid'),
+                                           ('removeItemRequest', 'item-uid')])
+        self.assertEqual(ItemIds(path).get('uid'), None)
+        self.assertEqual(os.stat(path).st_mode & 0777, 0600)
+
+    def test_item_ids_bytes(self):
+        path = os.path.join(self.tmpdir, 'cached.ics.ids')
+        ids = ItemIds(path)
+        # Not UTF-8
+        ids['r\xe9union-uid'] = 'item-r\xe9union-uid'
+        ids['tab\tand\nnewline'] = 'item id'
+        ids['removed'] = 'item-removed'
+        ids.pop('removed')
+        ids.close()
+
+        ids = ItemIds(path)
+        self.assertEqual(ids.ids, {'r\xe9union-uid': 'item-r\xe9union-uid',
+                                   'tab\tand\nnewline': 'item id'})
+        ids.close()
+        # Loading compacts the records
+        self.assertEqual(len(self.read(path).splitlines()), 2)
+
+    def test_invalid_item_ids(self):
+        path = self.write('cached.ics.ids', 'uid\titem-uid\n'
+                                            'garbage\n'
+                                            'bad\t\\x\n'
+                                            'truncated\tit')
+        ids = ItemIds(path)
+        self.assertEqual(ids.ids, {'uid': 'item-uid'})
+        ids.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+# groupwise-ics: synchronize GroupWise calendar to ICS file and back
+# Copyright (C) 2013  Cedric Bosdonnat <cedric@bosdonnat.fr>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import json
+import os
+import os.path
+import shutil
+import tempfile
+import cal
+import shards
+
+def create_events(events):
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0']
+    for (uid, dtstart, summary) in events:
+        lines.append('BEGIN:VEVENT')
+        lines.append('UID:%s' % uid)
+        lines.append('DTSTAMP:20131007T194119Z')
+        if dtstart is not None:
+            lines.append('DTSTART:%s' % dtstart)
+        lines.append('SUMMARY:%s' % summary)
+        lines.append('END:VEVENT')
+    lines.append('END:VCALENDAR')
+    return cal.Calendar('\r\n'.join(lines)).get_events_by_uid()
+
+class ShardsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.events = create_events([('sep', '20130930T220000Z', 'september'),
+                                     ('oct-1', '20131001T080000Z', 'october'),
+                                     ('oct-2', '20131031T080000Z', 'october'),
+                                     ('nov', '20131101T080000Z', 'november'),
+                                     ('todo', None, 'undated')])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_manifest(self):
+        return json.load(open(os.path.join(self.tmpdir, 'manifest.json')))
+
+    def test_monthly(self):
+        written = shards.write_shards(self.events, self.tmpdir)
+        self.assertEqual(written, ['2013-09', '2013-10', '2013-11', 'undated'])
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ['2013-09.ics', '2013-10.ics', '2013-11.ics',
+                          'manifest.json', 'undated.ics'])
+        october = open(os.path.join(self.tmpdir, '2013-10.ics')).read()
+        self.assertTrue('UID:oct-1' in october and 'UID:oct-2' in october)
+        self.assertFalse('UID:nov' in october)
+
+        # Nothing changed: nothing rewritten
+        self.assertEqual(shards.write_shards(self.events, self.tmpdir), [])
+
+        manifest = self.read_manifest()
+        self.events.update(create_events([('oct-2', '20131031T090000Z', 'moved')]))
+        del self.events['sep']
+        self.assertEqual(shards.write_shards(self.events, self.tmpdir), ['2013-10'])
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, '2013-09.ics')))
+
+        new_manifest = self.read_manifest()
+        self.assertEqual(new_manifest['shards']['2013-11'], manifest['shards']['2013-11'])
+        self.assertNotEqual(new_manifest['shards']['2013-10']['sha1'],
+                            manifest['shards']['2013-10']['sha1'])
+        self.assertFalse('2013-09' in new_manifest['shards'])
+
+    def test_fixed_size(self):
+        written = shards.write_shards(self.events, self.tmpdir, events_per_shard = 3)
+        self.assertEqual(written, ['0000', '0001', 'undated'])
+        second = open(os.path.join(self.tmpdir, '0001.ics')).read()
+        self.assertTrue('UID:nov' in second)
+
+if __name__ == '__main__':
+    unittest.main()
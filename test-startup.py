@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+# groupwise-ics: synchronize GroupWise calendar to ICS file and back
+# Copyright (C) 2013  Cedric Bosdonnat <cedric@bosdonnat.fr>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import gwconfig
+
+HEAVY_MODULES = ['imaplib', 'email', 'httplib', 'xml.etree', 'pyinotify']
+
+# Runs in a fresh interpreter: the test runner may have imported anything
+LOADED_MODULES = '''
+import imp, sys
+if sys.argv[1].endswith('.py'):
+    __import__(sys.argv[1][:-3])
+else:
+    imp.load_source('script', sys.argv[1])
+print ' '.join([name for name in sys.argv[2:] if name in sys.modules])
+'''
+
+class StartupTest(unittest.TestCase):
+
+    def get_loaded_modules(self, name):
+        directory = os.path.dirname(os.path.abspath(__file__))
+        output = subprocess.check_output([sys.executable, '-c', LOADED_MODULES,
+                                          name] + HEAVY_MODULES, cwd = directory)
+        return output.split()
+
+    def test_scripts(self):
+        self.assertEqual(self.get_loaded_modules('groupwise-to-ics'), [])
+        self.assertEqual(self.get_loaded_modules('ics-to-groupwise'), [])
+
+    def test_modules(self):
+        for name in ('connection.py', 'cal.py', 'gwconfig.py', 'streamdiff.py'):
+            self.assertEqual(self.get_loaded_modules(name), [])
+
+class ConfigTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def load(self, content):
+        path = os.path.join(self.tmpdir, 'config')
+        fp = open(path, 'w')
+        fp.write(content)
+        fp.close()
+        return gwconfig.load_config(path)
+
+    def test_ini(self):
+        config = self.load('# Keep this file only readable by you\n'
+                           '\n'
+                           '[other]\n'
+                           'imap = wrong.host\n'
+                           '[gw]\n'
+                           'imap = gw.hacker.com\n'
+                           'Login: joe\n'
+                           '; comment\n'
+                           'password = 100%=secret\n')
+        self.assertEqual(config, {'imap': 'gw.hacker.com',
+                                  'login': 'joe',
+                                  'password': '100%=secret',
+                                  'soap': None})
+
+    def test_ini_missing(self):
+        config = self.load('[gw]\nimap = gw.hacker.com\n')
+        self.assertEqual(config, {'imap': 'gw.hacker.com',
+                                  'login': None,
+                                  'password': None,
+                                  'soap': None})
+
+    def test_ini_invalid(self):
+        self.assertRaises(gwconfig.ConfigError, self.load, '[gw]\nimap\n')
+
+    def test_python(self):
+        config = self.load('# Keep this file only readable by you\n'
+                           '\n'
+                           'gw = {\n'
+                           '    \'imap\'      : \'gw.hacker.com\',\n'
+                           '    \'login\'     : \'joe\',\n'
+                           '    \'password\'  : \'secret\'\n'
+                           '}\n')
+        self.assertEqual(config, {'imap': 'gw.hacker.com',
+                                  'login': 'joe',
+                                  'password': 'secret',
+                                  'soap': None})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+# groupwise-ics: synchronize GroupWise calendar to ICS file and back
+# Copyright (C) 2013  Cedric Bosdonnat <cedric@bosdonnat.fr>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os.path
+import shutil
+import tempfile
+import cal
+import streamdiff
+
+VTIMEZONE = ['BEGIN:VTIMEZONE',
+             'TZID:Europe/Paris',
+             'BEGIN:DAYLIGHT',
+             'TZNAME:CEST',
+             'DTSTART:20130331T020000',
+             'TZOFFSETFROM:+0100',
+             'TZOFFSETTO:+0200',
+             'END:DAYLIGHT',
+             'BEGIN:STANDARD',
+             'TZNAME:CET',
+             'DTSTART:20131027T030000',
+             'TZOFFSETFROM:+0200',
+             'TZOFFSETTO:+0100',
+             'END:STANDARD',
+             'END:VTIMEZONE']
+
+def create_event(uid, summary, attendees, dtstart = 'DTSTART:20131008T130000Z'):
+    lines = ['BEGIN:VEVENT',
+             'UID:%s' % uid,
+             'DTSTAMP:20131007T194119Z',
+             dtstart,
+             'SUMMARY:%s' % summary]
+    for attendee in attendees:
+        lines.extend(['ATTENDEE;CUTYPE=INDIVIDUAL;ROLE=REQ-PARTICIPANT;PARTSTAT=ACCEPTED;',
+                      ' RSVP=TRUE;CN=%s:MAILTO:' % attendee,
+                      ' %s@hacker.com' % attendee.lower()])
+    lines.append('END:VEVENT')
+    return lines
+
+def create_calendar(events):
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0'] + VTIMEZONE
+    for event in events:
+        lines.extend(event)
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(lines) + '\r\n'
+
+class StreamDiffTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        fp = open(path, 'wb')
+        fp.write(content)
+        fp.close()
+        return path
+
+    def check_diff(self, old_data, new_data, memory_budget):
+        (changed, removed, added, unchanged) = cal.Calendar(old_data).diff(cal.Calendar(new_data))
+
+        old_path = self.write('old.ics', old_data)
+        new_path = self.write('new.ics', new_data)
+        result = {'changed': {}, 'removed': {}, 'added': {}, 'unchanged': {}}
+        for (kind, uid, value) in streamdiff.diff_files(old_path, new_path,
+                                                        memory_budget, self.tmpdir):
+            self.assertFalse(uid in result[kind])
+            result[kind][uid] = value
+
+        self.assertEqual(sorted(result['changed'].keys()), sorted(changed.keys()))
+        self.assertEqual(sorted(result['removed'].keys()), sorted(removed.keys()))
+        self.assertEqual(sorted(result['added'].keys()), sorted(added.keys()))
+        self.assertEqual(sorted(result['unchanged'].keys()), sorted(unchanged.keys()))
+
+        for uid in changed:
+            self.assertEqual(result['changed'][uid]['old'], changed[uid]['old'])
+            self.assertEqual(result['changed'][uid]['new'], changed[uid]['new'])
+        for uid in added:
+            self.assertEqual(result['added'][uid], added[uid])
+        for uid in removed:
+            self.assertEqual(result['removed'][uid].load(), removed[uid])
+        return result
+
+    def test_diff(self):
+        old_events = []
+        new_events = []
+        for index in range(200):
+            uid = 'uid-%03d' % index
+            old_events.append(create_event(uid, 'summary %d' % index, ['Joe', 'Alice']))
+            if index % 7 == 0:
+                # Removed
+                continue
+            elif index % 5 == 0:
+                new_events.append(create_event(uid, 'changed summary %d' % index, ['Joe', 'Alice']))
+            elif index % 3 == 0:
+                # Attendees order doesn't matter
+                new_events.append(create_event(uid, 'summary %d' % index, ['Alice', 'Joe']))
+            elif index % 11 == 0:
+                new_events.append(create_event(uid, 'summary %d' % index, ['Alice', 'Bob']))
+            else:
+                new_events.append(create_event(uid, 'summary %d' % index, ['Joe', 'Alice']))
+        for index in range(20):
+            new_events.append(create_event('new-uid-%d' % index, 'added %d' % index, ['Bob']))
+        # Shuffle the new calendar a bit
+        new_events.reverse()
+
+        # A tiny budget to force spilling to disk
+        result = self.check_diff(create_calendar(old_events), create_calendar(new_events), 2048)
+        self.assertEqual(len(result['added']), 20)
+        self.assertTrue(len(result['changed']) > 0)
+        self.assertTrue(len(result['unchanged']) > 0)
+
+    def test_duplicates_and_timezones(self):
+        old_events = [create_event('dup', 'first', ['Joe']),
+                      create_event('local', 'local time', ['Joe'],
+                                   'DTSTART;TZID=Europe/Paris:20131008T150000'),
+                      create_event('dup', 'second', ['Joe'])]
+        new_events = [create_event('local', 'local time', ['Joe'],
+                                   'DTSTART:20131008T130000Z'),
+                      create_event('dup', 'second', ['Joe'])]
+        result = self.check_diff(create_calendar(old_events), create_calendar(new_events), 1024 * 1024)
+        self.assertEqual(sorted(result['unchanged'].keys()), ['dup', 'local'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# groupwise-ics: synchronize GroupWise calendar to ICS file and back
+# Copyright (C) 2013  Cedric Bosdonnat <cedric@bosdonnat.fr>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import pyinotify
+import os.path
+from pipeline import CalendarPusher
+
+class EventHandler(pyinotify.ProcessEvent):
+    def my_init(self, pusher = None):
+        self.pusher = pusher
+
+    def calendar_changed(self, path):
+        # Only diffs and queues the changes: the pipeline workers push
+        # them without blocking the events handling
+        self.pusher.calendar_changed(path)
+
+    def process_IN_CLOSE_WRITE(self, event):
+        self.calendar_changed(event.pathname)
+
+    def process_IN_MOVED_TO(self, event):
+        self.calendar_changed(event.pathname)
+
+    def process_default(self, event):
+        print 'Unhandled event: %s' % (event.maskname)
+
+class CmpName:
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self, event):
+        if (getattr(event, 'name') is None):
+            return False
+        return self.name  == event.name
+
+def watch_calendar(cached_calendar, calendar, pipeline, memory_budget):
+    '''
+    @param pipeline: started PushPipeline, or None if there is no GroupWise
+                     connection to push the changes to
+    '''
+    wm = pyinotify.WatchManager()
+
+    # Evolution at least triggers the IN_MOVED_TO event. It writes to a hidden
+    # file and then moves it to the definitive target.
+    # Vim does something similar: writes to the tmp file and then creates the
+    # target file. So the event to monitor here is IN_CLOSE_WRITE
+    # gedit would get both events
+    # IN_MODIFY isn't watched: it fires while the file is written in place,
+    # and the missing events of a half-written calendar would be removed
+    mask = pyinotify.IN_MOVED_TO | pyinotify.IN_CLOSE_WRITE
+
+    print 'Watching: %s' % calendar
+    # Wake up every second to roll the cached calendar forward
+    notifier = pyinotify.Notifier(wm, timeout = 1000)
+    notifier.coalesce_events()
+    basename = os.path.basename(calendar)
+    dirname = os.path.dirname(calendar)
+    pusher = CalendarPusher(cached_calendar, pipeline, memory_budget)
+    wdd = wm.add_watch(dirname, mask, EventHandler(pyinotify.ChainIfTrue(
+                                        func=CmpName(basename)),
+                                            pusher = pusher))
+
+    try:
+        while True:
+            notifier.process_events()
+            if notifier.check_events():
+                notifier.read_events()
+            pusher.roll_forward()
+    except KeyboardInterrupt:
+        notifier.stop()
+    return 0